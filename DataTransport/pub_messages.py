@@ -3,6 +3,8 @@ import json
 import os
 import datetime
 from google.cloud import pubsub_v1
+# Shared helpers from projects/final_version_OOP, which must be on PYTHONPATH
+from segment_archive import append_segment, migrate_legacy_file
 import logging
 import time
 import csv
@@ -21,7 +23,8 @@ with open("lab_vehicle_ids.txt", "r") as f:
 # Setup filenames
 today_str = datetime.datetime.now().strftime("%Y%m%d")
 daily_file = f"breadcrumbs_{today_str}.json"
-all_file = "bcsample.json"
+all_file = "bcsample.json"  # legacy whole-file archive, migrated into archive_dir once
+archive_dir = "bcsample"
 
 # Load today's data if it exists
 if os.path.exists(daily_file):
@@ -87,19 +90,10 @@ if new_today_data:
     print(f"Updated today's temp file: {daily_file}")
 
     print(f"Number of new records to publish for {vehicle_ids}: {len(new_today_data)}")
-    # Append to all-time archive
-    if os.path.exists(all_file):
-        with open(all_file, "r") as f:
-            all_data = json.load(f)
-    else:
-        all_data = []
+    # Append to all-time archive as a new segment (only the new records are written)
+    migrate_legacy_file(archive_dir, all_file)
+    append_segment(archive_dir, new_today_data)
 
-    all_data.extend(new_today_data)
-
-    # Save combined archive
-    with open(all_file, "w") as f:
-        json.dump(all_data, f, indent=2)
-
-    print(f"Appended {len(new_today_data)} new records to {all_file} on {today_str}")
+    print(f"Appended {len(new_today_data)} new records to {archive_dir} on {today_str}")
 else:
     print(f"No new records today {today_str} — skipping update to archive.")
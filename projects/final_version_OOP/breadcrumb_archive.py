@@ -0,0 +1,110 @@
+# Columnar, compressed daily archive of gathered breadcrumbs (Parquet via pyarrow)
+
+import os
+import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Fixed schema so every part file of every day reads back with the same types;
+# fields outside it are not archived
+BREADCRUMB_SCHEMA = pa.schema([
+    ("EVENT_NO_TRIP", pa.int64()),
+    ("EVENT_NO_STOP", pa.int64()),
+    ("OPD_DATE", pa.string()),
+    ("VEHICLE_ID", pa.int64()),
+    ("METERS", pa.int64()),
+    ("ACT_TIME", pa.int64()),
+    ("GPS_LONGITUDE", pa.float64()),
+    ("GPS_LATITUDE", pa.float64()),
+    ("GPS_SATELLITES", pa.float64()),
+    ("GPS_HDOP", pa.float64()),
+])
+
+def _day_str(day):
+    if isinstance(day, (datetime.date, datetime.datetime)):
+        return day.strftime("%Y%m%d")
+    return str(day)
+
+def records_to_table(records):
+    # Column-major conversion of breadcrumb dicts into an Arrow table
+    columns = {
+        field.name: pa.array([record.get(field.name) for record in records], type=field.type)
+        for field in BREADCRUMB_SCHEMA
+    }
+    return pa.Table.from_pydict(columns, schema=BREADCRUMB_SCHEMA)
+
+class BreadcrumbArchiveWriter:
+    def __init__(self, root, day, row_group_size=50000, compression="zstd"):
+        # Each run writes one part file under <root>/<YYYYMMDD>/, one row group
+        # per row_group_size buffered records
+        self.day_dir = os.path.join(root, _day_str(day))
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.path = os.path.join(
+            self.day_dir, f"part-{datetime.datetime.now().strftime('%H%M%S%f')}-{os.getpid()}.parquet")
+        self._tmp_path = self.path + ".tmp"
+        self._buffer = []
+        self._writer = None
+        self.rows_written = 0
+
+    def append(self, records):
+        self._buffer.extend(records)
+        if len(self._buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        table = records_to_table(self._buffer)
+        if self._writer is None:
+            os.makedirs(self.day_dir, exist_ok=True)
+            self._writer = pq.ParquetWriter(self._tmp_path, BREADCRUMB_SCHEMA, compression=self.compression)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        # Finish the part file; it only becomes visible to readers once complete
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        # Give up on this run's part file after a write error: close the writer,
+        # remove the partial .tmp file and drop buffered rows. Returns how many
+        # rows were discarded.
+        discarded = self.rows_written + len(self._buffer)
+        self._buffer = []
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass  # the file is removed below anyway
+            self._writer = None
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self.rows_written = 0
+        return discarded
+
+def archive_paths(root, start_day, end_day=None):
+    # Part files for every day in [start_day, end_day], in day then write order
+    start, end = _day_str(start_day), _day_str(end_day or start_day)
+    if not os.path.isdir(root):
+        return []
+    paths = []
+    for day in sorted(os.listdir(root)):
+        if start <= day <= end and os.path.isdir(os.path.join(root, day)):
+            day_dir = os.path.join(root, day)
+            paths.extend(os.path.join(day_dir, name)
+                         for name in sorted(os.listdir(day_dir)) if name.endswith(".parquet"))
+    return paths
+
+def read_archive(root, start_day, end_day=None, columns=None):
+    # Load the selected columns for a date range into a DataFrame (no JSON parsing)
+    schema = BREADCRUMB_SCHEMA if columns is None else pa.schema([BREADCRUMB_SCHEMA.field(c) for c in columns])
+    tables = [pq.read_table(path, columns=columns) for path in archive_paths(root, start_day, end_day)]
+    if not tables:
+        return schema.empty_table().to_pandas()
+    return pa.concat_tables(tables).to_pandas()
@@ -0,0 +1,95 @@
+# Shared keep-alive HTTP client for the PSU busdata API
+
+import gzip
+import queue
+import threading
+import http.client
+import urllib.parse
+from rate_limit import ThrottledClient
+
+class BusdataClient:
+    def __init__(self, pool_size=16, timeout=30, gzip_encoding=True):
+        # pool_size caps the idle keep-alive connections kept per host
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.gzip_encoding = gzip_encoding
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self, scheme, host):
+        # One LIFO pool per (scheme, host) so the warmest connection is reused first
+        with self._lock:
+            pool = self._pools.get((scheme, host))
+            if pool is None:
+                pool = queue.LifoQueue(maxsize=self.pool_size)
+                self._pools[(scheme, host)] = pool
+            return pool
+
+    def _new_connection(self, scheme, host):
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def get(self, url):
+        # GET a URL over a pooled connection; returns (status, body bytes)
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        pool = self._get_pool(parts.scheme, parts.netloc)
+        headers = {"Connection": "keep-alive"}
+        if self.gzip_encoding:
+            headers["Accept-Encoding"] = "gzip"
+
+        while True:
+            try:
+                conn = pool.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self._new_connection(parts.scheme, parts.netloc)
+                reused = False
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # The server may have dropped an idle pooled connection; retry on a fresh one
+                if reused:
+                    continue
+                raise
+
+        if (response.getheader("Content-Encoding") or "").lower() == "gzip":
+            body = gzip.decompress(body)
+
+        if response.will_close:
+            conn.close()
+        else:
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        return response.status, body
+
+    def close(self):
+        # Close every idle pooled connection
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+def get_shared_client():
+    # Process-wide client so every pipeline (and every polling cycle) shares
+    # connections and one rate limit against the API
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = ThrottledClient(BusdataClient())
+        return _shared_client
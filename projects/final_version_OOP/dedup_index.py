@@ -0,0 +1,148 @@
+# Compact fingerprint index used to dedup gathered records
+
+import os
+import sys
+import json
+import struct
+import hashlib
+import numpy as np
+from array import array
+from bisect import bisect_left
+
+# Sidecar layout: MAGIC, the number of sorted fingerprints, then that many sorted
+# fingerprints followed by an append-only tail of unsorted ones (all little-endian uint64).
+# A file without the header (an older sidecar) is all tail.
+MAGIC = b"FPIDX\x00\x00\x01"
+HEADER = struct.Struct("<8sQ")
+
+def record_fingerprint(record):
+    # Stable 64-bit fingerprint computed straight from the record's fields
+    canonical = "\x1f".join(f"{key}\x1e{record[key]!r}" for key in sorted(record))
+    return int.from_bytes(hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest(), "little")
+
+class FingerprintSet:
+    # Set of 64-bit fingerprints stored as a sorted array('Q') (8 bytes each)
+    # plus a small hash set of recent additions that is merged in periodically
+    def __init__(self, fingerprints=(), sorted_base=None):
+        # sorted_base: an already sorted, duplicate-free array('Q'), used as is;
+        # fingerprints are then added to it like later additions
+        self._sorted = _merge(array("Q"), fingerprints) if sorted_base is None else sorted_base
+        self._recent = set()
+        if sorted_base is not None:
+            for fp in fingerprints:
+                self.add(fp)
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def __contains__(self, fp):
+        if fp in self._recent:
+            return True
+        i = bisect_left(self._sorted, fp)
+        return i < len(self._sorted) and self._sorted[i] == fp
+
+    def add(self, fp):
+        # Add a fingerprint; returns False if it was already present
+        if fp in self:
+            return False
+        self._recent.add(fp)
+        if len(self._recent) > _tail_limit(len(self._sorted)):
+            self._compact()
+        return True
+
+    def _compact(self):
+        # Merge recent additions into the sorted array (amortized by the threshold above)
+        if self._recent:
+            self._sorted = _merge(self._sorted, self._recent)
+            self._recent = set()
+
+    def sorted_fingerprints(self):
+        # Every fingerprint as one sorted array('Q')
+        self._compact()
+        return self._sorted
+
+def _tail_limit(sorted_count):
+    # Unsorted additions tolerated before they are merged into the sorted array
+    return max(4096, sorted_count >> 3)
+
+def _merge(sorted_fps, fingerprints):
+    # Sorted, duplicate-free union of a sorted array('Q') and more fingerprints
+    if isinstance(fingerprints, array):
+        extra = np.frombuffer(fingerprints, dtype=np.uint64)
+    else:
+        extra = np.fromiter(fingerprints, dtype=np.uint64)
+    merged = np.sort(np.concatenate([np.frombuffer(sorted_fps, dtype=np.uint64), extra]))
+    if len(merged):
+        merged = merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+    return array("Q", merged.tobytes())
+
+def _index_path(daily_file):
+    return daily_file + ".idx"
+
+def _to_bytes(fingerprints):
+    # Sidecar files are always little-endian uint64
+    arr = array("Q", fingerprints)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+def _read_index(idx_file):
+    # (sorted fingerprints, tail fingerprints) from a sidecar, in one bulk read
+    with open(idx_file, "rb") as f:
+        data = f.read()
+    sorted_count = 0
+    offset = 0
+    if len(data) >= HEADER.size:
+        magic, count = HEADER.unpack_from(data)
+        if magic == MAGIC:
+            sorted_count = count
+            offset = HEADER.size
+    fps = array("Q")
+    end = len(data) - (len(data) - offset) % 8  # ignore a torn trailing write
+    fps.frombytes(data[offset:end])
+    if sys.byteorder == "big":
+        fps.byteswap()
+    return fps[:sorted_count], fps[sorted_count:]
+
+def _write_index(idx_file, sorted_fps):
+    # Replace the sidecar with a fully sorted one (no tail)
+    tmp_file = idx_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(sorted_fps)))
+        f.write(_to_bytes(sorted_fps))
+    os.replace(tmp_file, idx_file)
+
+def load_index(daily_file):
+    # Load the dedup state for a daily file from its .idx sidecar: the sorted part is
+    # used as read, only the tail is added one by one, and a tail that has outgrown
+    # the sorted part is merged back into the sidecar. The sidecar is rebuilt from
+    # the daily file if missing or older than it.
+    idx_file = _index_path(daily_file)
+    if not os.path.exists(daily_file):
+        if os.path.exists(idx_file):
+            os.remove(idx_file)  # stale sidecar without its data file
+        return FingerprintSet()
+
+    if os.path.exists(idx_file) and os.path.getmtime(idx_file) >= os.path.getmtime(daily_file):
+        sorted_fps, tail = _read_index(idx_file)
+        if len(tail) <= _tail_limit(len(sorted_fps)):
+            return FingerprintSet(tail, sorted_base=sorted_fps)
+        fingerprints = FingerprintSet(sorted_base=_merge(sorted_fps, tail))
+        _write_index(idx_file, fingerprints.sorted_fingerprints())
+        return fingerprints
+
+    fps = []
+    with open(daily_file, "r") as f:
+        for line in f:
+            try:
+                fps.append(record_fingerprint(json.loads(line)))
+            except json.JSONDecodeError:
+                continue
+    fingerprints = FingerprintSet(fps)
+    _write_index(idx_file, fingerprints.sorted_fingerprints())
+    return fingerprints
+
+def append_index(daily_file, fingerprints):
+    # Append fingerprints to the sidecar; call after the daily file itself is written
+    with open(_index_path(daily_file), "ab") as f:
+        f.write(_to_bytes(fingerprints))
@@ -0,0 +1,206 @@
+# Shared gather-and-publish orchestration for the busdata pipelines
+
+import json
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from busdata_client import get_shared_client
+from pipeline_log import get_log_sink
+from publish_limiter import InFlightLimiter
+from publish_outbox import PublishOutbox
+from transport import PubSubTransport
+from message_envelope import iter_envelopes, encode_message
+from dedup_index import append_index
+
+class GatherPipeline:
+    # Subclasses provide fetch_vehicle(vid) and iter_new_records(); fetching,
+    # the daily file, publishing, the outbox and run() are shared
+    description = "gather"  # used in the run log line
+
+    def __init__(self, vehicle_file, topic_id, project_id, cred_path, daily_file, log_file, outbox_file,
+                 max_workers=16, http_client=None, envelope_records=0, envelope_bytes=1000000,
+                 envelope_codec="zlib", wire_schema=None, transport=None):
+        self.vehicle_file = vehicle_file
+        self.topic_id = topic_id
+        self.project_id = project_id
+        self.cred_path = cred_path
+        self.daily_file = daily_file
+        self.max_workers = max_workers  # concurrent vehicle fetches (1 = sequential)
+        self.http_client = http_client or get_shared_client()  # keep-alive pool shared across pipelines
+        self.envelope_records = envelope_records  # records per message (0 = one message per record)
+        self.envelope_bytes = envelope_bytes  # uncompressed byte budget per envelope
+        self.envelope_codec = envelope_codec  # "none", "zlib" or "zstd"
+        self.wire_schema = wire_schema  # compact binary messages when set
+        self.outbox = PublishOutbox(outbox_file) if outbox_file else None  # durable publish spool
+
+        # Pub/Sub by default; a FileLogTransport publishes to a local log instead
+        self.transport = transport or PubSubTransport(self.project_id, topic_id=self.topic_id, cred_path=self.cred_path)
+        self.log_sink = get_log_sink()
+        self.log_file = log_file
+
+    def log(self, msg, scope="main"):
+        # Timestamped log line (buffered: written and echoed by the shared background log sink)
+        self.log_sink.log(self.log_file, msg)
+
+    def load_vehicle_ids(self):
+        # Load list of vehicle IDs from the specified file
+        try:
+            with open(self.vehicle_file, "r") as f:
+                return [line.strip() for line in f if line.strip()]
+        except Exception as e:
+            self.log(f"Error reading vehicle file: {e}", "gather")
+            return []
+
+    def fetch_all(self, vehicle_ids):
+        # Fetch vehicles concurrently but yield (vid, result) in vehicle order, so
+        # dedup and the daily-file append stay deterministic; at most
+        # 2 * max_workers responses are buffered ahead of the consumer
+        workers = max(1, self.max_workers)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for vid in vehicle_ids:
+                pending.append((vid, executor.submit(self.fetch_vehicle, vid)))
+                if len(pending) >= 2 * workers:
+                    vid, future = pending.popleft()
+                    yield vid, future.result()
+            while pending:
+                vid, future = pending.popleft()
+                yield vid, future.result()
+
+    def append_daily(self, records, fingerprints):
+        # Spool new records to the outbox, append them to the daily file, then
+        # their fingerprints to its index; returns their (outbox seq, record) entries.
+        # The outbox goes first: once a record is in the daily file, a restart
+        # treats it as seen, so only the outbox can still get it published.
+        entries = self.outbox.spool(records) if self.outbox else [(None, record) for record in records]
+        with open(self.daily_file, "a") as f:
+            for record in records:
+                json.dump(record, f)
+                f.write("\n")
+        append_index(self.daily_file, fingerprints)
+        return entries
+
+    def gather_data(self):
+        # Download new records for each vehicle; returns their (outbox seq, record) entries
+        entries = []
+        for batch in self.iter_new_records():
+            entries.extend(batch)
+        return entries
+
+    def stream_data(self, queue_size=10000):
+        # Publish records as soon as they pass dedup; the bounded queue lets
+        # publishing overlap fetching and caps how many records are buffered
+        record_queue = queue.Queue(maxsize=queue_size)
+        done = object()
+
+        def produce():
+            try:
+                for batch in self.iter_new_records():
+                    for entry in batch:
+                        record_queue.put(entry)
+            except Exception as e:
+                self.log(f"Gather error: {e}", "gather")
+            finally:
+                record_queue.put(done)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        self.publish_data(iter(record_queue.get, done), queue_depth=record_queue.qsize)
+        producer.join()
+
+    def iter_messages(self, records):
+        # (message bytes, attributes, records it carries): one record per message,
+        # or batching envelopes when envelope_records is set
+        if self.envelope_records > 0:
+            return iter_envelopes(records, self.envelope_records, self.envelope_bytes,
+                                  self.envelope_codec, self.wire_schema)
+        return (encode_message(record, self.wire_schema) + ([record],) for record in records)
+
+    def log_publish_stats(self, limiter, queue_depth=None):
+        # Throughput and queue-depth snapshot for the publish stage
+        stats = limiter.stats()
+        msg = (f"Publish stats: {stats['acked']} acked, {stats['failed']} failed, "
+               f"{stats['messages_per_sec']:.0f} msg/s, in flight {stats['in_flight']} "
+               f"({stats['in_flight_bytes']} bytes, peak {stats['peak_in_flight']})")
+        if queue_depth is not None:
+            msg += f", gather queue depth {queue_depth()}"
+        self.log(msg, "publish")
+
+    def replay_outbox(self):
+        # Republish records spooled by earlier runs whose publish never got acked
+        if not self.outbox:
+            return
+        pending = list(self.outbox.pending())
+        if pending:
+            self.log(f"Replaying {len(pending)} unacked records from {self.outbox.path}", "publish")
+            self.publish_data(pending)
+        self.outbox.compact()
+
+    def publish_data(self, entries, max_in_flight=500, max_in_flight_bytes=10000000, queue_depth=None):
+        # Publish (outbox seq, record) entries to the pipeline's topic; acked seqs
+        # are marked done in the outbox (seq is None when the outbox is off)
+        self.log("Starting publishing...", "publish")
+        published = 0
+        skipped = 0
+        limiter = InFlightLimiter(max_in_flight, max_in_flight_bytes)
+
+        seq_queue = deque()
+
+        def tagged(entries):
+            # iter_messages keeps record order, so seqs line up with message batches
+            for seq, record in entries:
+                seq_queue.append(seq)
+                yield record
+
+        def future_callback(fut, idx, count, nbytes, seqs):
+            # Runs on the publisher's thread; hands the permit back to the limiter
+            try:
+                fut.result()
+                if self.outbox:
+                    self.outbox.mark_done(seqs)
+                limiter.release(nbytes, True)
+            except Exception as e:
+                limiter.release(nbytes, False, count)
+                self.log(f"[ERROR] Message {idx} ({count} records) failed to publish: {e}", "publish")
+
+        for i, (message, attributes, batch) in enumerate(self.iter_messages(tagged(entries)), start=1):
+            seqs = [seq_queue.popleft() for _ in batch]
+            limiter.acquire(len(message))
+            try:
+                future = self.transport.publish(message, **attributes)
+                future.add_done_callback(
+                    lambda fut, idx=i, count=len(batch), nbytes=len(message), seqs=seqs:
+                    future_callback(fut, idx, count, nbytes, seqs))
+                published += len(batch)
+            except Exception as e:
+                limiter.abandon(len(message))
+                skipped += len(batch)
+                self.log(f"[ERROR] Message {i} ({len(batch)} records) failed to publish: {e}", "publish")
+            if i % 50000 == 0:
+                self.log_publish_stats(limiter, queue_depth)
+
+        self.log(f"Waiting for {limiter.in_flight} publishes to complete...", "publish")
+        limiter.wait_idle()
+
+        skipped += limiter.failed_records
+        self.log(f"[DONE] Published: {published}, Skipped: {skipped}", "publish")
+        self.log_publish_stats(limiter, queue_depth)
+
+    def run(self, streaming=False, queue_size=10000, publish_delay=10):
+        # Run the complete pipeline; streaming overlaps gather and publish
+        start = time.time()
+        self.log(f"Starting full {self.description} pipeline...")
+        self.replay_outbox()
+        if streaming:
+            self.stream_data(queue_size)
+        else:
+            entries = self.gather_data()  # already spooled to the outbox
+            if entries:
+                time.sleep(publish_delay)  # slight delay for any system sync
+                self.publish_data(entries)
+        if self.outbox:
+            self.outbox.compact()
+        end = time.time()
+        self.log(f"Pipeline finished in {end - start:.2f} seconds.")
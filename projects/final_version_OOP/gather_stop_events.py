@@ -1,158 +1,112 @@
 # Refactored OOP-based TriMet StopEvent Pipeline with Comments
 
-import os
-import json
-import time
 import datetime
-import urllib.request
-from concurrent.futures import wait, FIRST_COMPLETED, as_completed
-from google.cloud import pubsub_v1
-from bs4 import BeautifulSoup
-
-class StopEventPipeline:
-    def __init__(self, vehicle_file, topic_id, project_id, cred_path):
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from gather_pipeline import GatherPipeline
+from wire_format import STOP_EVENT_WIRE_SCHEMA
+from dedup_index import load_index, record_fingerprint
+from stop_event_parser import parse_stop_events
+
+class StopEventPipeline(GatherPipeline):
+    description = "StopEvent"
+
+    def __init__(self, vehicle_file, topic_id, project_id, cred_path, max_workers=16, http_client=None, parse_workers=0,
+                 envelope_records=0, envelope_bytes=1000000, envelope_codec="zlib", binary_wire=False,
+                 transport=None, outbox_file="stop_event_outbox.log"):
         # Initialize configuration and setup
-        self.vehicle_file = vehicle_file
-        self.topic_id = topic_id
-        self.project_id = project_id
-        self.cred_path = cred_path
-        self.daily_file = f"stop_events_{datetime.datetime.now().strftime('%Y%m%d')}.json"
-
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = self.cred_path
-        self.publisher = pubsub_v1.PublisherClient()
-        self.topic_path = self.publisher.topic_path(self.project_id, self.topic_id)
-        self.logfile = "stop_pipeline.log"
+        super().__init__(vehicle_file, topic_id, project_id, cred_path,
+                         daily_file=f"stop_events_{datetime.datetime.now().strftime('%Y%m%d')}.json",
+                         log_file="stop_pipeline.log", outbox_file=outbox_file, max_workers=max_workers,
+                         http_client=http_client, envelope_records=envelope_records,
+                         envelope_bytes=envelope_bytes, envelope_codec=envelope_codec, transport=transport,
+                         wire_schema=STOP_EVENT_WIRE_SCHEMA if binary_wire else None)
+        self.parse_workers = parse_workers  # HTML parser processes (0 = parse in this process)
 
-    def log(self, msg):
-        # Log messages with timestamps to both console and file
-        ts = datetime.datetime.now().strftime("[%m-%d-%Y--%H:%M:%S.%f]")[:-3]
-        log_msg = f"{ts} {msg}"
-        print(log_msg)
-        with open(self.logfile, "a") as f:
-            f.write(log_msg + "\n")
+    def parse_html(self, html_text):
+        # Parse StopEvent HTML into structured JSON records (single-pass
+        # extractor, with BeautifulSoup as the fallback for unexpected layouts)
+        return parse_stop_events(html_text)
 
-    def load_vehicle_ids(self):
-        # Load vehicle IDs from file
+    def fetch_vehicle(self, vid):
+        # Download one vehicle's StopEvent page; returns "" on failure
+        url = f"https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num={vid}"
         try:
-            with open(self.vehicle_file, "r") as f:
-                return [line.strip() for line in f if line.strip()]
+            status, body = self.http_client.get(url)
+            if status == 200:
+                return body.decode("utf-8")
+            self.log(f"Vehicle {vid} fetch error: HTTP {status}")
         except Exception as e:
-            self.log(f"Error reading vehicle file: {e}")
-            return []
-
-    def parse_html(self, html_text):
-        # Parse StopEvent HTML into structured JSON records
-        soup = BeautifulSoup(html_text, "html.parser")
-        records = []
-        h1 = soup.find("h1")
-        service_date = h1.text.strip().split()[-1] if h1 and "stop data for" in h1.text else None
-
-        for h2 in soup.find_all("h2"):
-            if not h2.text.startswith("Stop events for PDX_TRIP"):
-                continue
-            pdx_trip = h2.text.strip().split()[-1]
-            table = h2.find_next("table")
-            if not table:
-                continue
-            headers = [th.text.strip() for th in table.find("tr").find_all("th")]
-            for tr in table.find_all("tr")[1:]:
-                values = [td.text.strip() for td in tr.find_all("td")]
-                if len(values) != len(headers):
+            self.log(f"Vehicle {vid} fetch error: {e}")
+        return ""
+
+    def parse_all(self, vehicle_ids):
+        # Yield (vid, records) in vehicle order. With parse_workers the raw HTML
+        # is parsed in a process pool; dedup and file appends stay in this process
+        if self.parse_workers <= 0:
+            for vid, raw in self.fetch_all(vehicle_ids):
+                if not raw.strip():
+                    continue
+                try:
+                    yield vid, self.parse_html(raw)
+                except Exception as e:
+                    self.log(f"Vehicle {vid} parse error: {e}")
+            return
+
+        pending = deque()
+        # spawn, not fork: the fetch threads are already running when workers start
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context) as pool:
+            for vid, raw in self.fetch_all(vehicle_ids):
+                if not raw.strip():
                     continue
-                record = dict(zip(headers, values))
-                record["pdx_trip"] = pdx_trip
-                record["service_date"] = service_date
-                records.append(record)
-        return records
+                pending.append((vid, pool.submit(parse_stop_events, raw)))
+                while len(pending) > 2 * self.parse_workers or (pending and pending[0][1].done()):
+                    vid, future = pending.popleft()
+                    records = self._parse_result(vid, future)
+                    if records is not None:
+                        yield vid, records
+            while pending:
+                vid, future = pending.popleft()
+                records = self._parse_result(vid, future)
+                if records is not None:
+                    yield vid, records
+
+    def _parse_result(self, vid, future):
+        # Records from a pooled parse job, or None if parsing failed
+        try:
+            return future.result()
+        except Exception as e:
+            self.log(f"Vehicle {vid} parse error: {e}")
+            return None
 
-    def gather_data(self):
-        # Main data gathering logic
+    def iter_new_records(self):
+        # Yield each vehicle's new (outbox seq, record) entries once they are deduped and stored
         self.log("Gathering StopEvent data...")
         vehicle_ids = self.load_vehicle_ids()
 
-        existing = set()
-        if os.path.exists(self.daily_file):
-            with open(self.daily_file, "r") as f:
-                for line in f:
-                    try:
-                        rec = json.loads(line)
-                        existing.add(json.dumps(rec, sort_keys=True))
-                    except json.JSONDecodeError:
-                        continue
-
-        new_records = []
-        for vid in vehicle_ids:
-            url = f"https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num={vid}"
-            try:
-                with urllib.request.urlopen(url) as response:
-                    raw = response.read().decode("utf-8")
-                    if not raw.strip():
-                        continue
-                    parsed = self.parse_html(raw)
-                    for record in parsed:
-                        rec_str = json.dumps(record, sort_keys=True)
-                        if rec_str not in existing:
-                            new_records.append(record)
-                            existing.add(rec_str)
-            except Exception as e:
-                self.log(f"Vehicle {vid} fetch error: {e}")
-
-        if new_records:
-            with open(self.daily_file, "a") as f:
-                for rec in new_records:
-                    json.dump(rec, f)
-                    f.write("\n")
-            self.log(f"Appended {len(new_records)} new StopEvent records.")
+        existing = load_index(self.daily_file)  # bulk-loaded from the .idx sidecar
+
+        total = 0
+        for vid, parsed in self.parse_all(vehicle_ids):
+            new_records = []
+            new_fingerprints = []
+            for record in parsed:
+                fp = record_fingerprint(record)
+                if existing.add(fp):
+                    new_fingerprints.append(fp)
+                    new_records.append(record)
+            if new_records:
+                entries = self.append_daily(new_records, new_fingerprints)
+                total += len(new_records)
+                yield entries
+
+        if total:
+            self.log(f"Appended {total} new StopEvent records.")
         else:
             self.log("No new StopEvent records fetched.")
 
-        return new_records
-
-    def publish_data(self, records, max_in_flight=500):
-        # Publish validated StopEvent records to Pub/Sub topic
-        self.log("Publishing StopEvent data...")
-        published = 0
-        skipped = 0
-        futures = []
-
-        def callback(fut):
-            try:
-                fut.result()
-            except Exception:
-                nonlocal skipped
-                skipped += 1
-
-        for i, record in enumerate(records, 1):
-            try:
-                msg = json.dumps(record).encode("utf-8")
-                future = self.publisher.publish(self.topic_path, msg)
-                future.add_done_callback(callback)
-                futures.append(future)
-                published += 1
-                if len(futures) >= max_in_flight:
-                    done, not_done = wait(futures, return_when=FIRST_COMPLETED)
-                    futures = list(not_done)
-            except Exception as e:
-                skipped += 1
-                self.log(f"[ERROR] Record {i} publish failed: {e}")
-
-        self.log(f"Waiting for {len(futures)} publish tasks...")
-        for fut in as_completed(futures):
-            pass
-
-        self.log(f"[DONE] Published: {published}, Skipped: {skipped}")
-
-    def run(self):
-        # Entry point for running the entire pipeline
-        start = time.time()
-        self.log("Starting full StopEvent pipeline...")
-        records = self.gather_data()
-        if records:
-            time.sleep(10)  # Optional wait before publishing
-            self.publish_data(records)
-        end = time.time()
-        self.log(f"Pipeline finished in {end - start:.2f} seconds.")
-
 # Execution entry point
 if __name__ == "__main__":
     pipeline = StopEventPipeline(
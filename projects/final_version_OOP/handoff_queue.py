@@ -0,0 +1,56 @@
+# Bounded handoff queue between subscriber callbacks and worker threads
+
+import threading
+from collections import deque
+
+class HandoffQueue:
+    def __init__(self, capacity=10000):
+        # put() blocks once capacity items are waiting; workers take many items per lock
+        self.capacity = capacity
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self.blocked_puts = 0  # times a producer had to wait for room
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def drained(self):
+        # Closed and nothing left for the workers
+        return self._closed and not self._items
+
+    def put(self, item):
+        # False once the queue is closed, so the caller can nack the item
+        with self._lock:
+            if len(self._items) >= self.capacity:
+                self.blocked_puts += 1
+                while len(self._items) >= self.capacity and not self._closed:
+                    self._not_full.wait()
+            if self._closed:
+                return False
+            self._items.append(item)
+            self._not_empty.notify()
+            return True
+
+    def get_batch(self, max_items, timeout=None):
+        # Up to max_items in arrival order, waiting up to timeout for the first one;
+        # [] on timeout or once the queue is drained
+        with self._lock:
+            if not self._items and not self._closed:
+                self._not_empty.wait(timeout)
+            items = self._items
+            count = min(max_items, len(items))
+            batch = [items.popleft() for _ in range(count)]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def close(self):
+        # Refuse new items; workers finish what is already queued
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
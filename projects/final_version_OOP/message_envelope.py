@@ -0,0 +1,117 @@
+# Batching envelope: many records packed into one Pub/Sub message
+
+import json
+import zlib
+import struct
+from wire_format import encode_batch, decode_batch, is_binary
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
+
+# Header: magic, envelope version, codec, payload format, record count
+MAGIC = b"TMB"
+VERSION = 1
+HEADER = struct.Struct(">3sBBBI")
+
+CODECS = {"none": 0, "zlib": 1, "zstd": 2}
+FORMAT_JSON = 0    # payload is a JSON array of record dicts
+FORMAT_BINARY = 1  # payload is a wire_format binary batch
+
+def _compress(codec_id, payload):
+    if codec_id == CODECS["zlib"]:
+        return zlib.compress(payload, 6)
+    if codec_id == CODECS["zstd"]:
+        if zstandard is None:
+            raise ValueError("zstd codec requested but the zstandard package is not installed")
+        return zstandard.ZstdCompressor().compress(payload)
+    return payload
+
+def _decompress(codec_id, payload):
+    if codec_id == CODECS["zlib"]:
+        return zlib.decompress(payload)
+    if codec_id == CODECS["zstd"]:
+        if zstandard is None:
+            raise ValueError("zstd envelope received but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if codec_id == CODECS["none"]:
+        return payload
+    raise ValueError(f"Unknown envelope codec {codec_id}")
+
+def _pack(payload, count, codec, payload_format):
+    codec_id = CODECS[codec]
+    header = HEADER.pack(MAGIC, VERSION, codec_id, payload_format, count)
+    return header + _compress(codec_id, payload)
+
+def pack_envelope(encoded_records, codec="zlib"):
+    # Pack already JSON-encoded records (bytes) into one envelope message
+    return _pack(b"[" + b",".join(encoded_records) + b"]", len(encoded_records), codec, FORMAT_JSON)
+
+def _iter_json_envelopes(records, max_records, max_bytes, codec):
+    batch = []
+    encoded = []
+    size = 0
+    for record in records:
+        data = json.dumps(record).encode("utf-8")
+        if encoded and (len(encoded) >= max_records or size + len(data) > max_bytes):
+            yield pack_envelope(encoded, codec), {}, batch
+            batch, encoded, size = [], [], 0
+        batch.append(record)
+        encoded.append(data)
+        size += len(data) + 1
+    if encoded:
+        yield pack_envelope(encoded, codec), {}, batch
+
+def iter_envelopes(records, max_records=1000, max_bytes=1000000, codec="zlib", schema=None):
+    # Yield (message bytes, attributes, records in it), closing an envelope at
+    # max_records records or max_bytes of uncompressed payload. With a wire
+    # schema the payload is binary; chunks that do not fit it fall back to JSON.
+    if schema is None:
+        yield from _iter_json_envelopes(records, max_records, max_bytes, codec)
+        return
+    chunk_size = max(1, min(max_records, max_bytes // schema.record.size))
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield from _binary_or_json(chunk, max_records, max_bytes, codec, schema)
+            chunk = []
+    if chunk:
+        yield from _binary_or_json(chunk, max_records, max_bytes, codec, schema)
+
+def _binary_or_json(chunk, max_records, max_bytes, codec, schema):
+    payload = encode_batch(schema, chunk)
+    if payload is None:
+        yield from _iter_json_envelopes(chunk, max_records, max_bytes, codec)
+    else:
+        yield _pack(payload, len(chunk), codec, FORMAT_BINARY), schema.attributes(), chunk
+
+def encode_message(record, schema=None):
+    # Single-record message: binary when the record fits the schema, else JSON
+    if schema is not None:
+        payload = encode_batch(schema, [record])
+        if payload is not None:
+            return payload, schema.attributes()
+    return json.dumps(record).encode("utf-8"), {}
+
+def decode_message(data):
+    # Records carried by a message: envelopes and binary batches are unpacked,
+    # anything else is read as a single JSON record
+    if data[:3] == MAGIC and len(data) >= HEADER.size:
+        _, version, codec_id, payload_format, count = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"Unsupported envelope version {version}")
+        payload = _decompress(codec_id, data[HEADER.size:])
+        if payload_format == FORMAT_BINARY:
+            records = decode_batch(payload)
+        elif payload_format == FORMAT_JSON:
+            records = json.loads(payload)
+        else:
+            raise ValueError(f"Unknown envelope payload format {payload_format}")
+        if len(records) != count:
+            raise ValueError(f"Envelope declared {count} records but carried {len(records)}")
+        return records
+    if is_binary(data):
+        return decode_batch(data)
+    return [json.loads(data.decode("utf-8"))]
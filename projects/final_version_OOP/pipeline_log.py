@@ -0,0 +1,90 @@
+# Buffered log sink: log calls enqueue a line, a background thread batches the writes
+
+import sys
+import queue
+import atexit
+import datetime
+import threading
+
+class BufferedLogSink:
+    def __init__(self, flush_interval=0.5, echo=True, max_batch=10000):
+        self.flush_interval = flush_interval
+        self.echo = echo  # also print lines to stdout
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, path, msg):
+        # Timestamp now (same format as before), write later
+        ts = datetime.datetime.now().strftime("[%m-%d-%Y--%H:%M:%S.%f]")[:-3]
+        self._queue.put((path, f"{ts} {msg}"))
+
+    def flush(self):
+        # Block until everything logged so far has been written
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put((None, done))
+        done.wait()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put((None, None))
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # Drain whatever else is queued so one open/write covers many lines
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            lines_by_path = {}
+            markers = []
+            for path, line in batch:
+                if path is None:
+                    markers.append(line)
+                else:
+                    lines.append(line)
+                    lines_by_path.setdefault(path, []).append(line)
+            if self.echo and lines:
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
+            self._write(lines_by_path)
+
+            for marker in markers:
+                if marker is None:
+                    return
+                marker.set()
+
+    def _write(self, lines_by_path):
+        for path, lines in lines_by_path.items():
+            try:
+                with open(path, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError as e:
+                sys.stderr.write(f"Log write to {path} failed: {e}\n")
+
+_shared_sink = None
+_shared_lock = threading.Lock()
+
+def get_log_sink():
+    # One background writer per process, shared by every pipeline
+    global _shared_sink
+    with _shared_lock:
+        if _shared_sink is None:
+            _shared_sink = BufferedLogSink()
+        return _shared_sink
@@ -0,0 +1,66 @@
+# In-flight limiter for Pub/Sub publishing: permits are released from done-callbacks
+
+import time
+import threading
+
+class InFlightLimiter:
+    def __init__(self, max_messages=500, max_bytes=10000000):
+        # Bounds outstanding publishes by message count and by payload bytes
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.peak_in_flight = 0
+        self.acked = 0
+        self.failed = 0
+        self.failed_records = 0
+        self.started = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        # Block until the message fits; an oversized message may go alone
+        with self._cond:
+            while self.in_flight >= self.max_messages or (
+                    self.in_flight and self.in_flight_bytes + nbytes > self.max_bytes):
+                self._cond.wait()
+            self.in_flight += 1
+            self.in_flight_bytes += nbytes
+            if self.in_flight > self.peak_in_flight:
+                self.peak_in_flight = self.in_flight
+
+    def release(self, nbytes, ok, records=1):
+        # Called from the publish future's done-callback
+        with self._cond:
+            self.in_flight -= 1
+            self.in_flight_bytes -= nbytes
+            if ok:
+                self.acked += 1
+            else:
+                self.failed += 1
+                self.failed_records += records
+            self._cond.notify_all()
+
+    def abandon(self, nbytes):
+        # Return a permit for a message that was never handed to the publisher
+        with self._cond:
+            self.in_flight -= 1
+            self.in_flight_bytes -= nbytes
+            self._cond.notify_all()
+
+    def wait_idle(self):
+        # Block until every outstanding publish has completed
+        with self._cond:
+            while self.in_flight:
+                self._cond.wait()
+
+    def stats(self):
+        with self._cond:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return {
+                "acked": self.acked,
+                "failed": self.failed,
+                "in_flight": self.in_flight,
+                "in_flight_bytes": self.in_flight_bytes,
+                "peak_in_flight": self.peak_in_flight,
+                "messages_per_sec": (self.acked + self.failed) / elapsed,
+            }
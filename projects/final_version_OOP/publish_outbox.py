@@ -0,0 +1,91 @@
+# Durable publish outbox: records are spooled when gathered and marked done on ack
+
+import os
+import sys
+import json
+import threading
+from array import array
+
+class PublishOutbox:
+    def __init__(self, path):
+        # <path> holds "seq<TAB>json" lines; <path>.done holds acked seqs as uint64s
+        self.path = path
+        self.done_path = path + ".done"
+        self.next_seq = 0
+        self._done_file = None
+        self._lock = threading.Lock()
+        for seq, _ in self._read_spool():
+            self.next_seq = seq + 1
+
+    def _read_spool(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                seq, sep, data = line.partition("\t")
+                if not sep or not data.endswith("\n"):
+                    continue  # torn last line from a crash mid-write
+                yield int(seq), data
+
+    def _read_done(self):
+        done = array("Q")
+        if os.path.exists(self.done_path):
+            with open(self.done_path, "rb") as f:
+                data = f.read()
+            done.frombytes(data[:len(data) - len(data) % 8])
+            if sys.byteorder == "big":
+                done.byteswap()
+        return set(done)
+
+    def pending(self):
+        # (seq, record) for every spooled record that was never acked, in spool order
+        with self._lock:
+            if self._done_file is not None:
+                self._done_file.flush()
+        done = self._read_done()
+        for seq, data in self._read_spool():
+            if seq not in done:
+                yield seq, json.loads(data)
+
+    def spool(self, records):
+        # Append records and fsync; returns their (seq, record) entries once on disk
+        with self._lock:
+            first = self.next_seq
+            self.next_seq += len(records)
+        with open(self.path, "a") as f:
+            for seq, record in enumerate(records, start=first):
+                f.write(f"{seq}\t{json.dumps(record)}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return list(enumerate(records, start=first))
+
+    def mark_done(self, seqs):
+        # Called from publish callbacks once the message carrying seqs is acked
+        data = array("Q", seqs)
+        if sys.byteorder == "big":
+            data.byteswap()
+        with self._lock:
+            if self._done_file is None:
+                self._done_file = open(self.done_path, "ab")
+            self._done_file.write(data.tobytes())
+
+    def compact(self):
+        # Drop acked entries; removes both files when nothing is left pending
+        with self._lock:
+            if self._done_file is not None:
+                self._done_file.close()
+                self._done_file = None
+        pending = list(self.pending())
+        if pending:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for seq, record in pending:
+                    f.write(f"{seq}\t{json.dumps(record)}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        if os.path.exists(self.done_path):
+            os.remove(self.done_path)
+        return len(pending)
@@ -0,0 +1,102 @@
+# Client-side rate limiting, AIMD concurrency control and retries for busdata fetches
+
+import time
+import random
+import threading
+
+# Status codes worth retrying: throttling and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        # rate tokens per second, holding at most burst tokens
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Block until a token is available
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AimdLimiter:
+    def __init__(self, initial=8, minimum=1, maximum=32, latency_target=2.0, decrease_factor=0.5):
+        # Concurrency limit that grows by ~1 per window of healthy responses and
+        # is cut by decrease_factor on errors or responses slower than latency_target
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, ok):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.latency_target:
+                # One decrease per latency window, so a burst of failures from
+                # the same window does not collapse the limit
+                if now - self._last_decrease > self.latency_target:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+class ThrottledClient:
+    def __init__(self, client, rate=20, limiter=None, max_retries=4, backoff_base=0.5, backoff_cap=30.0):
+        # Wraps an HTTP client exposing get(url) -> (status, body)
+        self.client = client
+        self.bucket = TokenBucket(rate) if rate else None
+        self.limiter = limiter or AimdLimiter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def backoff(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def get(self, url):
+        # GET with rate limiting, adaptive concurrency and retries on transient failures
+        attempt = 0
+        while True:
+            if self.bucket:
+                self.bucket.acquire()
+            self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                status, body = self.client.get(url)
+            except Exception:
+                self.limiter.release(time.monotonic() - start, ok=False)
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                ok = status not in RETRYABLE_STATUS
+                self.limiter.release(time.monotonic() - start, ok)
+                if ok or attempt >= self.max_retries:
+                    return status, body
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,62 @@
+# Append-only segmented archive: one immutable JSON Lines segment per run plus a small manifest
+
+import os
+import json
+import datetime
+
+MANIFEST = "manifest.json"
+
+def load_manifest(archive_dir):
+    path = os.path.join(archive_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {"segments": [], "total_records": 0}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_manifest(archive_dir, manifest):
+    # Replace the manifest atomically so readers never see a half-written index
+    path = os.path.join(archive_dir, MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def append_segment(archive_dir, records):
+    # Write records as a new segment and register it; costs O(len(records)),
+    # not O(archive size). Returns the archive's total record count.
+    os.makedirs(archive_dir, exist_ok=True)
+    manifest = load_manifest(archive_dir)
+    seq = manifest["segments"][-1]["seq"] + 1 if manifest["segments"] else 1
+    name = f"segment-{seq:06d}.jsonl"
+    path = os.path.join(archive_dir, name)
+    with open(path + ".tmp", "w") as f:
+        for record in records:
+            json.dump(record, f)
+            f.write("\n")
+    os.replace(path + ".tmp", path)
+
+    manifest["segments"].append({
+        "seq": seq,
+        "name": name,
+        "records": len(records),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+    })
+    manifest["total_records"] += len(records)
+    save_manifest(archive_dir, manifest)
+    return manifest["total_records"]
+
+def iter_records(archive_dir):
+    # Lazily yield every archived record, segment by segment in append order
+    for segment in load_manifest(archive_dir)["segments"]:
+        with open(os.path.join(archive_dir, segment["name"]), "r") as f:
+            for line in f:
+                yield json.loads(line)
+
+def migrate_legacy_file(archive_dir, legacy_file):
+    # One-time import of an old whole-file JSON array archive as the first segment
+    if not os.path.exists(legacy_file) or os.path.exists(os.path.join(archive_dir, MANIFEST)):
+        return
+    with open(legacy_file, "r") as f:
+        records = json.load(f)
+    append_segment(archive_dir, records)
+    os.replace(legacy_file, legacy_file + ".migrated")
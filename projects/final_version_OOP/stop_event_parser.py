@@ -0,0 +1,134 @@
+# Parsers for the TriMet StopEvent HTML page (getStopEvents)
+
+import re
+import html
+from bs4 import BeautifulSoup
+
+_H1_RE = re.compile(r"<h1\b[^>]*>(.*?)</h1\s*>", re.IGNORECASE | re.DOTALL)
+_H2_RE = re.compile(r"<h2\b[^>]*>(.*?)</h2\s*>", re.IGNORECASE | re.DOTALL)
+_H2_OPEN_RE = re.compile(r"<h2\b", re.IGNORECASE)
+_TABLE_RE = re.compile(r"<(/?)table\b[^>]*>", re.IGNORECASE)
+_TR_RE = re.compile(r"<tr\b[^>]*>", re.IGNORECASE)
+# A cell runs until the next cell, row or table boundary (closing tags are optional)
+_CELL_RE = re.compile(r"<(t[dh])\b[^>]*>(.*?)(?=<(?:/?t[dh]|/?tr|/?table)\b|\Z)",
+                      re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]*>")
+_OPEN_RE = re.compile(r"<(?:t[dh]|tr)\b", re.IGNORECASE)
+_CLOSE_RE = re.compile(r"</(?:t[dh]|tr)\s*>", re.IGNORECASE)
+
+TRIP_HEADING = "Stop events for PDX_TRIP"
+
+def _text(fragment):
+    # Equivalent of BeautifulSoup's .text for a small fragment (not stripped)
+    if "<" in fragment:
+        fragment = _TAG_RE.sub("", fragment)
+    if "&" in fragment:
+        fragment = html.unescape(fragment)
+    return fragment
+
+def _tables(html_text):
+    # (start, inner html) of every top-level table; nested or unclosed tables
+    # are outside the known layout
+    tables = []
+    start = None
+    for m in _TABLE_RE.finditer(html_text):
+        if not m.group(1):
+            if start is not None:
+                raise ValueError("nested table")
+            start = m.start()
+            inner_start = m.end()
+        else:
+            if start is None:
+                continue  # stray </table>
+            tables.append((start, html_text[inner_start:m.start()]))
+            start = None
+    if start is not None:
+        raise ValueError("unclosed table")
+    return tables
+
+def _parse_table(inner):
+    # Header names from the first row's <th> cells and every later row's <td> values
+    # html.parser nests unclosed cells/rows instead of closing them implicitly
+    if len(_OPEN_RE.findall(inner)) != len(_CLOSE_RE.findall(inner)):
+        raise ValueError("unclosed row or cell")
+    rows = _TR_RE.split(inner)[1:]
+    if not rows:
+        raise ValueError("table without rows")
+    headers = [_text(text).strip() for tag, text in _CELL_RE.findall(rows[0]) if tag.lower() == "th"]
+    body = []
+    for row in rows[1:]:
+        values = [_text(text).strip() for tag, text in _CELL_RE.findall(row) if tag.lower() == "td"]
+        if len(values) == len(headers):
+            body.append(values)
+    return headers, body
+
+def parse_stop_events_fast(html_text):
+    # Single-pass regex extractor for the known page layout; raises ValueError
+    # when the page does not look like that layout
+    h2_matches = list(_H2_RE.finditer(html_text))
+    if len(h2_matches) != len(_H2_OPEN_RE.findall(html_text)):
+        raise ValueError("unclosed h2")
+
+    h1 = _H1_RE.search(html_text)
+    if h1 is None and re.search(r"<h1\b", html_text, re.IGNORECASE):
+        raise ValueError("unclosed h1")
+    h1_text = _text(h1.group(1)) if h1 else ""
+    service_date = h1_text.strip().split()[-1] if h1 and "stop data for" in h1_text else None
+
+    tables = _tables(html_text)
+    table_starts = [start for start, _ in tables]
+    parsed_tables = {}
+    records = []
+    t = 0
+    for m in h2_matches:
+        heading = _text(m.group(1))
+        if not heading.startswith(TRIP_HEADING):
+            continue
+        pdx_trip = heading.strip().split()[-1]
+        # Same as h2.find_next("table"): the first table after this heading
+        while t < len(table_starts) and table_starts[t] < m.end():
+            t += 1
+        if t == len(table_starts):
+            continue
+        if t not in parsed_tables:
+            parsed_tables[t] = _parse_table(tables[t][1])
+        headers, body = parsed_tables[t]
+        for values in body:
+            record = dict(zip(headers, values))
+            record["pdx_trip"] = pdx_trip
+            record["service_date"] = service_date
+            records.append(record)
+    return records
+
+def parse_stop_events_bs4(html_text):
+    # Reference parser built on a full BeautifulSoup tree
+    soup = BeautifulSoup(html_text, "html.parser")
+    records = []
+    h1 = soup.find("h1")
+    service_date = h1.text.strip().split()[-1] if h1 and "stop data for" in h1.text else None
+
+    for h2 in soup.find_all("h2"):
+        if not h2.text.startswith(TRIP_HEADING):
+            continue
+        pdx_trip = h2.text.strip().split()[-1]
+        table = h2.find_next("table")
+        if not table:
+            continue
+        headers = [th.text.strip() for th in table.find("tr").find_all("th")]
+        for tr in table.find_all("tr")[1:]:
+            values = [td.text.strip() for td in tr.find_all("td")]
+            if len(values) != len(headers):
+                continue
+            record = dict(zip(headers, values))
+            record["pdx_trip"] = pdx_trip
+            record["service_date"] = service_date
+            records.append(record)
+    return records
+
+def parse_stop_events(html_text):
+    # Parse a StopEvent page into records, falling back to BeautifulSoup for
+    # pages outside the layout the fast extractor understands
+    try:
+        return parse_stop_events_fast(html_text)
+    except ValueError:
+        return parse_stop_events_bs4(html_text)
@@ -0,0 +1,253 @@
+# Shared streaming-pull, decode-worker and micro-batch machinery for the subscribers
+
+import time
+import threading
+import logging
+from collections import defaultdict
+from message_envelope import decode_message
+from transport import PubSubTransport
+from handoff_queue import HandoffQueue
+
+class StreamingSubscriber:
+    # Subclasses provide transform_batch(records), transform_all() and write_rows(df);
+    # delivery, decode workers, micro-batching, acking and error tracking are shared
+    description = "subscriber"  # used in the startup log line
+
+    def __init__(self, project_id, subscription_id, cred_path, db_config, idle_timeout=60, transport=None,
+                 queue_capacity=10000, drain_size=500, workers=1, batch_records=5000, batch_seconds=2.0,
+                 ack_after_commit=False):
+        self.project_id = project_id
+        self.subscription_id = subscription_id
+        self.cred_path = cred_path
+        self.db_config = db_config
+        self.idle_timeout = idle_timeout
+        self.drain_size = drain_size  # messages a worker takes from the handoff queue at once
+        self.workers = workers  # decode worker threads
+        self.batch_records = batch_records  # continuous mode: flush at this many records...
+        self.batch_seconds = batch_seconds  # ...or after this many seconds
+        self.ack_after_commit = ack_after_commit  # continuous mode: ack messages only once their rows are committed
+
+        self.logger = self._init_logger()
+        # Pub/Sub by default; a FileLogTransport reads a local log instead
+        self.transport = transport or PubSubTransport(self.project_id, subscription_id=self.subscription_id,
+                                                      cred_path=self.cred_path)
+
+        # Callbacks only enqueue; when the queue is full the client's flow control holds back delivery
+        self.handoff = HandoffQueue(queue_capacity)
+        self.worker_threads = []
+        self.collected_messages = []
+        self.unacked_messages = []  # (message, its records) behind collected_messages, in ack-after-commit mode
+        self.buffer_cond = threading.Condition()  # guards collected_messages across worker threads
+        self.last_message_time = time.time()
+        self.total_received = 0
+        self.total_inserted = 0
+        self.streaming_future = None
+        self.continuous = False
+        self.idle_reached = threading.Event()
+
+        self.error_counters = defaultdict(int)
+        self.error_first_message = {}
+        self.error_lock = threading.Lock()
+
+    def _init_logger(self):
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        return logging.getLogger(type(self).__module__)
+
+    def callback(self, message):
+        # Runs on the client's callback threads: hand the message to the workers
+        self.last_message_time = time.time()
+        if not self.handoff.put(message):
+            message.nack()  # shutting down; the message is redelivered later
+
+    def drain_handoff(self):
+        # Worker thread: decode queued messages in batches until the queue is closed and empty
+        while not self.handoff.drained:
+            messages = self.handoff.get_batch(self.drain_size, timeout=0.5)
+            if messages:
+                self.process_messages(messages)
+
+    def process_messages(self, messages):
+        # Decode a batch of messages into collected records
+        records = []
+        unacked = []
+        for message in messages:
+            try:
+                decoded = decode_message(message.data)  # plain JSON record or batching envelope
+            except Exception as e:
+                decoded = []
+                with self.error_lock:
+                    err_type = "decode_error"
+                    self.error_counters[err_type] += 1
+                    if err_type not in self.error_first_message:
+                        self.error_first_message[err_type] = f"Error decoding message: {e}"
+            records.extend(decoded)
+            if self.ack_after_commit:
+                unacked.append((message, decoded))
+            else:
+                message.ack()
+        with self.buffer_cond:
+            self.collected_messages.extend(records)
+            self.unacked_messages.extend(unacked)
+            self.total_received += len(records)
+            if len(self.collected_messages) >= self.batch_records:
+                self.buffer_cond.notify()
+
+    def start_workers(self):
+        self.worker_threads = [threading.Thread(target=self.drain_handoff, daemon=True) for _ in range(self.workers)]
+        for thread in self.worker_threads:
+            thread.start()
+
+    def stop_workers(self):
+        # Refuse further deliveries and wait for the workers to drain the queue
+        self.handoff.close()
+        for thread in self.worker_threads:
+            thread.join()
+        if self.handoff.blocked_puts:
+            self.logger.info(f"Handoff queue was full {self.handoff.blocked_puts} times")
+
+    def idle_monitor(self):
+        # Stop subscriber after idle timeout
+        while True:
+            time.sleep(min(60, self.idle_timeout))
+            idle = time.time() - self.last_message_time
+            if idle > self.idle_timeout:
+                self.logger.info("Idle timeout reached. Shutting down subscriber...")
+                self.idle_reached.set()
+                if not self.continuous:  # continuous mode flushes and acks before stopping the stream
+                    self.stop_stream()
+                break
+
+    def stop_stream(self):
+        if self.streaming_future:
+            self.streaming_future.cancel()
+
+    def shutdown(self):
+        # Only once everything has been acked: acks on a closed transport are lost
+        self.stop_stream()
+        self.transport.close()
+
+    def run(self, continuous=False):
+        # Start subscription and wait for data; continuous mode inserts micro-batches as they fill
+        if self.ack_after_commit and not continuous:
+            # Batch mode commits only after the stream stops, so every message would stay
+            # unacked until then and flow control would stop delivery at queue_capacity
+            raise ValueError("ack_after_commit requires continuous mode")
+        self.logger.info(f"Starting {self.description} with idle timeout monitoring...")
+        self.continuous = continuous
+        self.start_workers()
+        self.streaming_future = self.transport.subscribe(self.callback, max_messages=self.handoff.capacity)
+
+        monitor_thread = threading.Thread(target=self.idle_monitor, daemon=True)
+        monitor_thread.start()
+
+        if continuous:
+            self.run_micro_batches()
+            self.flush_batch()  # acks still go through while the stream is open
+            self.stop_stream()
+
+        # Stop the stream, drain the workers, insert and ack; only then close the transport
+        try:
+            self.streaming_future.result()
+        except Exception as e:
+            self.logger.info(f"Subscriber stopped: {e}")
+        self.stop_workers()
+
+        if continuous:
+            self.flush_batch()  # whatever arrived before the stream stopped
+            self.end_of_stream()
+            self.shutdown()
+            self.print_error_summary()
+            discarded = self.total_received - self.total_inserted
+            self.logger.info(f"SUMMARY: Received: {self.total_received}, Inserted: {self.total_inserted}, Discarded: {discarded}")
+            return
+
+        self.logger.info(f"Total messages received: {self.total_received}")
+        self.logger.info("Validating and transforming for DB insert...")
+
+        df = self.transform_all()
+        inserted = self.insert_into_db(df)
+        self.shutdown()
+        self.print_error_summary()
+        if df is None:
+            return
+
+        discarded = self.total_received - inserted
+        self.logger.info(f"SUMMARY: Received: {self.total_received}, Inserted: {inserted}, Discarded: {discarded}")
+
+    def run_micro_batches(self):
+        # Flush every batch_records records or batch_seconds, whichever comes first,
+        # until the streaming pull stops
+        deadline = time.monotonic() + self.batch_seconds
+        while not self.idle_reached.is_set() and not self.streaming_future.done():
+            with self.buffer_cond:
+                remaining = deadline - time.monotonic()
+                if len(self.collected_messages) < self.batch_records and remaining > 0:
+                    self.buffer_cond.wait(min(remaining, 1.0))
+                    continue
+            self.flush_batch()
+            deadline = time.monotonic() + self.batch_seconds
+
+    def flush_batch(self):
+        # Validate, transform and insert the records buffered so far
+        with self.buffer_cond:
+            records, self.collected_messages = self.collected_messages, []
+            batch, self.unacked_messages = self.unacked_messages, []
+        inserted = self.commit_batch(self.transform_batch(records), batch)
+        self.total_inserted += inserted
+        return inserted
+
+    def commit_batch(self, df, batch):
+        # Insert df; with ack_after_commit the (message, records) pairs it came from
+        # are acked only after the rows are committed (at-least-once), and nacked
+        # if the insert fails
+        if not self.ack_after_commit:
+            return self.insert_into_db(df)
+        try:
+            inserted = self.write_rows(df) if df is not None and not df.empty else 0
+        except Exception as e:
+            self.track_error(f"DB insert error: {e}")
+            self.batch_failed()
+            self.transport.nack([message for message, _ in batch])
+            with self.buffer_cond:
+                # Redelivered records are counted again when they come back
+                self.total_received -= sum(len(records) for _, records in batch)
+            return 0
+        self.transport.acknowledge(self.batch_committed(batch))
+        return inserted
+
+    def batch_committed(self, batch):
+        # Messages that can be acked now that batch is committed: all of them,
+        # unless a subclass holds records back for a later batch
+        return [message for message, _ in batch]
+
+    def batch_failed(self):
+        # The batch's insert failed and its messages are being redelivered:
+        # undo any state the batch advanced
+        pass
+
+    def end_of_stream(self):
+        # Continuous mode, after the last flush: close out any state kept across batches
+        pass
+
+    def insert_into_db(self, df):
+        if df is None or df.empty:
+            return 0
+        try:
+            return self.write_rows(df)
+        except Exception as e:
+            self.track_error(f"DB insert error: {e}")
+            return 0
+
+    def track_error(self, error_type, count=1):
+        if not count:
+            return
+        with self.error_lock:
+            self.error_counters[error_type] += count
+            if error_type not in self.error_first_message:
+                self.error_first_message[error_type] = error_type
+
+    def print_error_summary(self):
+        self.logger.info("Error summary:")
+        for err_type, count in self.error_counters.items():
+            msg = self.error_first_message.get(err_type, err_type)
+            self.logger.info(f"{msg} - Occurred {count} times")
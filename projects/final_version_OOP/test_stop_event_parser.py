@@ -0,0 +1,88 @@
+# Parity tests: the single-pass StopEvent extractor against the BeautifulSoup parser
+
+import pytest
+from stop_event_parser import parse_stop_events, parse_stop_events_bs4, parse_stop_events_fast
+
+COLUMNS = ["vehicle_number", "leave_time", "train", "route_number", "direction", "service_key",
+           "trip_number", "stop_time", "arrive_time", "dwell", "location_id", "door", "lift",
+           "ons", "offs", "estimated_load", "maximum_speed", "train_mileage", "pattern_distance",
+           "location_distance", "x_coordinate", "y_coordinate", "data_source", "schedule_status"]
+
+def trip_table(trip, rows):
+    header = "".join(f"<th>{name}</th>" for name in COLUMNS)
+    body = "".join(
+        "<tr>" + "".join(f"<td>{(row * 31 + i) % 9973}</td>" for i in range(len(COLUMNS))) + "</tr>\n"
+        for row in range(rows))
+    return f"<h2>Stop events for PDX_TRIP {trip}</h2>\n<table>\n<tr>{header}</tr>\n{body}</table>\n"
+
+def realistic_page(trips=5, rows=20):
+    tables = "".join(trip_table(231000000 + trip, rows) for trip in range(trips))
+    return ("<html><head><title>Stop events</title></head><body>\n"
+            "<h1>TriMet CAD/AVL stop data for 2025-05-07</h1>\n" + tables + "</body></html>")
+
+QUIRK_PAGES = {
+    # h2 text is matched before stripping, so a leading space hides the trip
+    "unstripped h2 prefix": (
+        "<h1>TriMet CAD/AVL stop data for 2025-05-07</h1>"
+        "<h2> Stop events for PDX_TRIP 1</h2><table><tr><th>a</th></tr><tr><td>1</td></tr></table>"
+        "<h2>Stop events for PDX_TRIP 2 </h2><table><tr><th>a</th></tr><tr><td>2</td></tr></table>"),
+    # headers come only from the first row's th cells; th cells in data rows are ignored
+    "first-row th headers": (
+        "<h1>stop data for 2025-05-07</h1><h2>Stop events for PDX_TRIP 3</h2>"
+        "<table><tr><th>a</th><td>skip</td><th>b</th></tr>"
+        "<tr><th>x</th><td>1</td><td>2</td></tr><tr><td>3</td><td>4</td></tr></table>"),
+    # rows whose cell count differs from the header are dropped
+    "short and long rows": (
+        "<h1>stop data for 2025-05-07</h1><h2>Stop events for PDX_TRIP 4</h2>"
+        "<table><tr><th>a</th><th>b</th></tr><tr><td>1</td></tr>"
+        "<tr><td>1</td><td>2</td><td>3</td></tr><tr><td>5</td><td>6</td></tr><tr></tr></table>"),
+    "attributes, case and entities": (
+        "<H1 class='t'>TriMet stop data for 2025-05-07</H1>"
+        "<H2 id=x>Stop events for PDX_TRIP 5</H2><TABLE border=1><TR><TH scope=col> a </TH><TH>b&amp;c</TH></TR>"
+        "<TR class=r><TD align=right> <b>1</b> </TD><TD><a href='#'>x &lt; y</a></TD></TR></TABLE>"),
+    "foreign headings and tables": (
+        "<h1>stop data for 2025-05-07</h1><h2>Summary</h2><table><tr><th>z</th></tr><tr><td>0</td></tr></table>"
+        "<h2>Stop events for PDX_TRIP 6</h2><table><tr><th>a</th></tr><tr><td>6</td></tr></table>"
+        "<h2>Stop events for PDX_TRIP 7</h2>"),
+    "two headings share a table": (
+        "<h1>stop data for 2025-05-07</h1><h2>Stop events for PDX_TRIP 8</h2>"
+        "<h2>Stop events for PDX_TRIP 9</h2><table><tr><th>a</th></tr><tr><td>1</td></tr></table>"),
+    "no service date": (
+        "<h1>Vehicle 3001</h1><h2>Stop events for PDX_TRIP 10</h2>"
+        "<table><tr><th>a</th></tr><tr><td>1</td></tr></table>"),
+    "empty page": "",
+}
+
+# Pages outside the fast extractor's layout: it refuses them and the BeautifulSoup fallback is used
+FALLBACK_PAGES = {
+    "nested table": (
+        "<h1>stop data for 2025-05-07</h1><h2>Stop events for PDX_TRIP 11</h2>"
+        "<table><tr><th>a</th><th>b</th></tr><tr><td><table><tr><td>in</td></tr></table></td><td>2</td></tr></table>"),
+    "unclosed cells": (
+        "<h1>stop data for 2025-05-07</h1><h2>Stop events for PDX_TRIP 12</h2>"
+        "<table><tr><th>a<th>b</tr><tr><td>1<td>2</tr></table>"),
+    "unclosed table": (
+        "<h1>stop data for 2025-05-07</h1><h2>Stop events for PDX_TRIP 13</h2>"
+        "<table><tr><th>a</th></tr><tr><td>1</td></tr>"),
+    "unclosed h2": (
+        "<h1>stop data for 2025-05-07</h1><h2>Stop events for PDX_TRIP 14"
+        "<table><tr><th>a</th></tr><tr><td>1</td></tr></table>"),
+}
+
+def test_realistic_page_matches_bs4():
+    page = realistic_page()
+    records = parse_stop_events_fast(page)
+    assert len(records) == 5 * 20
+    assert records == parse_stop_events_bs4(page)
+
+@pytest.mark.parametrize("name", sorted(QUIRK_PAGES))
+def test_quirks_match_bs4(name):
+    page = QUIRK_PAGES[name]
+    assert parse_stop_events_fast(page) == parse_stop_events_bs4(page)
+
+@pytest.mark.parametrize("name", sorted(FALLBACK_PAGES))
+def test_unknown_layouts_fall_back_to_bs4(name):
+    page = FALLBACK_PAGES[name]
+    with pytest.raises(ValueError):
+        parse_stop_events_fast(page)
+    assert parse_stop_events(page) == parse_stop_events_bs4(page)
@@ -0,0 +1,263 @@
+# Message transports: Google Pub/Sub, or a local append-only file log for load tests
+
+import os
+import json
+import time
+import struct
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+class PubSubTransport:
+    def __init__(self, project_id, topic_id=None, subscription_id=None, cred_path=None):
+        # Publishing needs topic_id, subscribing needs subscription_id
+        from google.cloud import pubsub_v1  # only required when talking to GCP
+        if cred_path:
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
+        self.pubsub = pubsub_v1
+        self.publisher = None
+        self.subscriber = None
+        if topic_id:
+            self.publisher = pubsub_v1.PublisherClient()
+            self.topic_path = self.publisher.topic_path(project_id, topic_id)
+        if subscription_id:
+            self.subscriber = pubsub_v1.SubscriberClient()
+            self.subscription_path = self.subscriber.subscription_path(project_id, subscription_id)
+
+    def publish(self, data, **attributes):
+        # Future resolved once Pub/Sub acknowledges the message
+        return self.publisher.publish(self.topic_path, data, **attributes)
+
+    def subscribe(self, callback, max_messages=None, max_bytes=None):
+        # Streaming pull; max_messages/max_bytes bound unacked messages held by the client
+        kwargs = {}
+        if max_messages or max_bytes:
+            kwargs["flow_control"] = self.pubsub.types.FlowControl(
+                max_messages=max_messages or 1000, max_bytes=max_bytes or 100 * 1024 * 1024)
+        return self.subscriber.subscribe(self.subscription_path, callback=callback, **kwargs)
+
+    def acknowledge(self, messages):
+        # The client's dispatcher coalesces these into batched acknowledge requests
+        for message in messages:
+            message.ack()
+
+    def nack(self, messages):
+        for message in messages:
+            message.nack()
+
+    def close(self):
+        if self.subscriber:
+            self.subscriber.close()
+
+# Frame header: attributes length, data length; attributes are a JSON object
+FRAME = struct.Struct(">II")
+
+class LogMessage:
+    # Mirrors the parts of a Pub/Sub message the subscribers use
+    __slots__ = ("data", "attributes", "ack_id", "_stream")
+
+    def __init__(self, data, attributes, ack_id, stream):
+        self.data = data
+        self.attributes = attributes
+        self.ack_id = ack_id  # log offset just past this frame
+        self._stream = stream
+
+    def ack(self):
+        self._stream.ack(self.ack_id)
+
+    def nack(self):
+        # Redelivered by the stream; the consumer offset cannot move past it meanwhile
+        self._stream.nack_many((self.ack_id,))
+
+class FileLogTransport:
+    def __init__(self, directory, topic, subscription=None, poll_interval=0.05, commit_interval=0.5):
+        # Messages go to <directory>/<topic>.log; each subscription keeps its
+        # committed consumer offset in <directory>/<topic>.<subscription>.offset
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{topic}.log")
+        self.offset_path = os.path.join(directory, f"{topic}.{subscription}.offset") if subscription else None
+        self.poll_interval = poll_interval
+        self.commit_interval = commit_interval
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._streams = []
+
+    def publish(self, data, **attributes):
+        # One write per frame on an O_APPEND handle, so concurrent publishers never interleave
+        meta = json.dumps(attributes).encode("utf-8") if attributes else b""
+        frame = FRAME.pack(len(meta), len(data)) + meta + data
+        future = Future()
+        try:
+            with self._write_lock:
+                if self._writer is None:
+                    self._writer = open(self.path, "ab", buffering=0)
+                self._writer.write(frame)
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def subscribe(self, callback, max_messages=None, max_bytes=None):
+        # Tail the log from the committed offset on a reader thread; max_messages
+        # bounds unacked messages (max_bytes is accepted for Pub/Sub parity)
+        stream = _LogStream(self, callback, max_messages or 1000)
+        self._streams.append(stream)
+        stream.start()
+        return stream
+
+    def acknowledge(self, messages):
+        # One pass per stream: the committed offset advances once for the whole batch
+        by_stream = {}
+        for message in messages:
+            by_stream.setdefault(message._stream, []).append(message.ack_id)
+        for stream, offsets in by_stream.items():
+            stream.ack_many(offsets)
+
+    def nack(self, messages):
+        by_stream = {}
+        for message in messages:
+            by_stream.setdefault(message._stream, []).append(message.ack_id)
+        for stream, offsets in by_stream.items():
+            stream.nack_many(offsets)
+
+    def committed_offset(self):
+        if self.offset_path and os.path.exists(self.offset_path):
+            with open(self.offset_path, "r") as f:
+                return int(f.read().strip() or 0)
+        return 0
+
+    def commit_offset(self, offset):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def close(self):
+        for stream in self._streams:
+            stream.cancel()
+            stream.result()
+            if self.offset_path:
+                stream._save()  # acks that arrived after the reader stopped
+        self._streams = []
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+class _LogStream:
+    # Streaming-pull future for FileLogTransport: result() blocks until cancel()
+    def __init__(self, transport, callback, max_outstanding):
+        self.transport = transport
+        self.callback = callback
+        self.max_outstanding = max_outstanding
+        self.committed = transport.committed_offset()
+        self._saved = self.committed
+        self._last_save = time.monotonic()
+        self._unacked = deque()  # [end offset, acked] in delivery order
+        self._index = {}
+        self._redeliver = {}  # nacked frames waiting to be delivered again, by end offset
+        self._rewind = False  # set by nack: the reader rescans from the committed offset
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def ack(self, offset):
+        self.ack_many((offset,))
+
+    def ack_many(self, offsets):
+        with self._cond:
+            for offset in offsets:
+                entry = self._index.pop(offset, None)
+                if entry is not None:
+                    entry[1] = True
+            # The committed offset only moves past a contiguous run of acked frames
+            while self._unacked and self._unacked[0][1]:
+                self.committed = self._unacked.popleft()[0]
+            self._cond.notify_all()
+        if self.transport.offset_path and time.monotonic() - self._last_save >= self.transport.commit_interval:
+            self._save()
+
+    def nack_many(self, offsets):
+        # Nacked frames keep their place in _unacked, so the committed offset still
+        # stops at them, but no longer hold a flow-control slot until redelivered
+        with self._cond:
+            for offset in offsets:
+                entry = self._index.pop(offset, None)
+                if entry is not None:
+                    self._redeliver[offset] = entry
+                    self._rewind = True
+            self._cond.notify_all()
+
+    def _save(self):
+        with self._cond:
+            if self.committed == self._saved:
+                return
+            self.transport.commit_offset(self.committed)
+            self._saved = self.committed
+            self._last_save = time.monotonic()
+
+    def _read_loop(self):
+        try:
+            while not os.path.exists(self.transport.path):
+                if self._stop.wait(self.transport.poll_interval):
+                    return
+            with open(self.transport.path, "rb") as f:
+                f.seek(self.committed)
+                position = self.committed
+                resume = position  # frames up to here were delivered; only nacked ones go again
+                while not self._stop.is_set():
+                    with self._cond:
+                        if self._rewind:
+                            self._rewind = False
+                            resume = max(resume, position)
+                            position = self.committed
+                            f.seek(position)
+                    header = f.read(FRAME.size)
+                    if len(header) == FRAME.size:
+                        meta_len, data_len = FRAME.unpack(header)
+                        body = f.read(meta_len + data_len)
+                        if len(body) == meta_len + data_len:
+                            position += FRAME.size + len(body)
+                            if position > resume or position in self._redeliver:
+                                attributes = json.loads(body[:meta_len]) if meta_len else {}
+                                self._deliver(LogMessage(body[meta_len:], attributes, position, self))
+                            continue
+                    # Partial frame from a publisher mid-write: rewind and wait for the rest
+                    f.seek(position)
+                    self._stop.wait(self.transport.poll_interval)
+        except Exception as e:
+            self._error = e
+        finally:
+            if self.transport.offset_path:
+                self._save()
+
+    def _deliver(self, message):
+        with self._cond:
+            # Frames waiting for redelivery keep the offset in place but free their slot
+            while (len(self._unacked) - len(self._redeliver) >= self.max_outstanding
+                   and not self._stop.is_set()):
+                self._cond.wait(self.transport.poll_interval)
+            entry = self._redeliver.pop(message.ack_id, None)
+            if entry is None:
+                entry = [message.ack_id, False]
+                self._unacked.append(entry)
+            self._index[message.ack_id] = entry
+        self.callback(message)
+
+    def cancel(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        return True
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def result(self, timeout=None):
+        self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,182 @@
+# Per-trip state carried across micro-batches so speeds can be computed incrementally
+
+import time
+import heapq
+import pandas as pd
+
+# Columns a held-back first reading needs to be emitted later
+PENDING_FIELDS = ["tstamp", "GPS_LATITUDE", "GPS_LONGITUDE", "EVENT_NO_TRIP", "METERS", "ACT_TIME"]
+
+class TripState:
+    __slots__ = ("meters", "act_time", "event_time", "pending", "touched")
+
+    def __init__(self, meters, act_time, event_time, pending, touched):
+        self.meters = meters          # METERS of the latest reading seen
+        self.act_time = act_time      # ACT_TIME of the latest reading seen
+        self.event_time = event_time  # OPD_DATE + ACT_TIME of the latest reading, epoch seconds
+        self.pending = pending        # first reading (tuple of PENDING_FIELDS) still waiting for its speed
+        self.touched = touched        # monotonic time of the last update, for TTL eviction
+
+class TripStateStore:
+    def __init__(self, ttl=3600.0, allowed_lateness=1800, max_pending=100000):
+        # A trip is finalized once the event-time watermark (latest reading seen minus
+        # allowed_lateness) passes its last reading; ttl is a wall-clock backstop.
+        # At most max_pending single-reading trips are held; the oldest is dropped first.
+        self.ttl = ttl
+        self.allowed_lateness = allowed_lateness
+        self.max_pending = max_pending
+        self.trips = {}  # dict order = least recently touched first
+        self.pending_trips = {}  # trips holding a first reading, oldest first
+        self.closing = []  # heap of (event_time, trip_id); stale entries are skipped
+        self.max_event_time = None
+        self.evicted = 0
+        self.late_readings = 0
+
+    def __len__(self):
+        return len(self.trips)
+
+    def get(self, trip_id):
+        return self.trips.get(trip_id)
+
+    @property
+    def watermark(self):
+        if self.max_event_time is None:
+            return None
+        return self.max_event_time - self.allowed_lateness
+
+    def snapshot(self):
+        # Copy of everything compute_speeds, finalize and evict_expired change, for restore()
+        trips = {trip_id: TripState(state.meters, state.act_time, state.event_time, state.pending, state.touched)
+                 for trip_id, state in self.trips.items()}
+        return (trips, dict(self.pending_trips), list(self.closing), self.max_event_time,
+                self.evicted, self.late_readings)
+
+    def restore(self, snapshot):
+        # Roll back to a snapshot(), e.g. when the batch it preceded failed to commit
+        (self.trips, self.pending_trips, self.closing, self.max_event_time,
+         self.evicted, self.late_readings) = snapshot
+
+    def is_pending(self, trip_id):
+        # True while the trip's first reading is held back waiting for its second
+        return trip_id in self.pending_trips
+
+    def _drop(self, trip_id):
+        # Forget a trip; True if it never got a second reading
+        state = self.trips.pop(trip_id)
+        self.pending_trips.pop(trip_id, None)
+        return state.pending is not None
+
+    def evict_expired(self, now=None):
+        # Drop trips untouched for ttl seconds; returns how many were single-reading trips
+        now = time.monotonic() if now is None else now
+        # Trips are kept least recently touched first, so only the expired head is visited
+        dropped = 0
+        while self.trips:
+            trip_id = next(iter(self.trips))
+            if now - self.trips[trip_id].touched < self.ttl:
+                break
+            dropped += self._drop(trip_id)
+            self.evicted += 1
+        return dropped
+
+    def finalize(self, watermark=None):
+        # Close every trip whose last reading is older than the watermark (all trips when
+        # watermark is None and the stream has ended). Returns the number of closed
+        # trips that had fewer than 2 readings.
+        short_trips = 0
+        if watermark is None:
+            for trip_id in list(self.trips):
+                short_trips += self._drop(trip_id)
+            self.closing = []
+            return short_trips
+        while self.closing and self.closing[0][0] < watermark:
+            event_time, trip_id = heapq.heappop(self.closing)
+            state = self.trips.get(trip_id)
+            if state is not None and state.event_time == event_time:
+                short_trips += self._drop(trip_id)
+        return short_trips
+
+    def _hold(self, trip_id):
+        # Bound the pending buffer; returns how many single-reading trips were pushed out
+        self.pending_trips[trip_id] = None
+        dropped = 0
+        while len(self.pending_trips) > self.max_pending:
+            oldest = next(iter(self.pending_trips))
+            dropped += self._drop(oldest)
+        return dropped
+
+    def compute_speeds(self, df):
+        # df: one batch sorted by EVENT_NO_TRIP, ACT_TIME. Returns (rows that can be
+        # emitted with their speed, single-reading trips dropped from the full pending
+        # buffer). Rows match a full-batch groupby shift as long as each trip's
+        # readings arrive in ACT_TIME order across batches.
+        df = df.reset_index(drop=True)
+        trips = df["EVENT_NO_TRIP"]
+        starts = trips.ne(trips.shift())
+        ends = trips.ne(trips.shift(-1))
+        event_times = df["tstamp"].to_numpy("datetime64[s]").astype("int64")
+
+        prev_meters = df.groupby("EVENT_NO_TRIP")["METERS"].shift()
+        prev_act_time = df.groupby("EVENT_NO_TRIP")["ACT_TIME"].shift()
+
+        # The first row of a known trip continues from the stored reading
+        start_rows = df.index[starts]
+        states = [self.trips.get(trip_id) for trip_id in trips[starts]]
+        known_rows = [row for row, state in zip(start_rows, states) if state is not None]
+        if known_rows:
+            known = [state for state in states if state is not None]
+            prev_meters.loc[known_rows] = [state.meters for state in known]
+            prev_act_time.loc[known_rows] = [state.act_time for state in known]
+            self.late_readings += sum(df.at[row, "ACT_TIME"] < state.act_time
+                                      for row, state in zip(known_rows, known))
+
+        speed = (df["METERS"] - prev_meters) / (df["ACT_TIME"] - prev_act_time)
+        df["speed"] = speed.fillna(0).clip(lower=0).round(2)
+
+        # A trip's very first reading takes the speed of its second reading
+        keep = pd.Series(True, index=df.index)
+        released = []
+        held = []
+        now = time.monotonic()
+        for row, state in zip(start_rows, states):
+            trip_id = trips[row]
+            if state is None:
+                if not ends[row]:
+                    df.at[row, "speed"] = df.at[row + 1, "speed"]
+                    pending = None
+                else:
+                    keep[row] = False  # only reading so far: hold it until the next one arrives
+                    pending = tuple(df.loc[row, PENDING_FIELDS])
+                    held.append(trip_id)
+                state = TripState(None, None, None, pending, now)
+            elif state.pending is not None:
+                released.append(state.pending + (df.at[row, "speed"],))
+                state.pending = None
+                self.pending_trips.pop(trip_id, None)
+            self.trips.pop(trip_id, None)
+            self.trips[trip_id] = state
+
+        for row in df.index[ends]:
+            state = self.trips[trips[row]]
+            state.meters = df.at[row, "METERS"]
+            state.act_time = df.at[row, "ACT_TIME"]
+            state.event_time = int(event_times[row])
+            state.touched = now
+            heapq.heappush(self.closing, (state.event_time, trips[row]))
+        if len(event_times):
+            batch_max = int(event_times.max())
+            if self.max_event_time is None or batch_max > self.max_event_time:
+                self.max_event_time = batch_max
+
+        overflow = 0
+        for trip_id in held:
+            if trip_id in self.trips:
+                overflow += self._hold(trip_id)
+
+        out = df[keep]
+        if released:
+            pending_df = pd.DataFrame(released, columns=PENDING_FIELDS + ["speed"])
+            pending_df["tstamp"] = pd.to_datetime(pending_df["tstamp"])
+            out = pd.concat([pending_df, out], ignore_index=True)
+            out = out.sort_values(["EVENT_NO_TRIP", "ACT_TIME"], kind="stable")
+        return out, overflow
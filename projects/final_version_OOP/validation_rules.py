@@ -0,0 +1,196 @@
+# Declarative validation rules for both subscribers, compiled into one columnar pass per batch
+
+from collections import Counter
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+
+KINDS = ("not-null", "range", "positive", "int-parseable")
+
+class Rule:
+    def __init__(self, field, kind, message, low=None, high=None, cast=float):
+        # message is formatted with the failing record's value, e.g. "HDOP {value} too high".
+        # range: low <= value <= high (either bound optional). positive: cast(value) > 0.
+        if kind not in KINDS:
+            raise ValueError(f"Unknown rule kind {kind}")
+        self.field = field
+        self.kind = kind
+        self.message = message
+        self.low = low
+        self.high = high
+        self.cast = cast
+
+class RuleSet:
+    def __init__(self, rules):
+        # Rules are checked in order; a record is reported under its first failing rule
+        self.rules = list(rules)
+        if len(self.rules) > 127:
+            raise ValueError("At most 127 rules per rule set")
+        self.fields = list(dict.fromkeys(rule.field for rule in self.rules))
+        # Fields with a float comparison get their null mask from the float conversion
+        self.numeric_fields = {rule.field for rule in self.rules
+                               if rule.kind == "range" or (rule.kind == "positive" and rule.cast is not int)}
+
+    def first_failures(self, columns):
+        # columns: field -> list or array of values (a DataFrame works too). Per row: 0 if
+        # every rule passes, else 1 + index of the first failing rule. Each field is
+        # converted once and shared by all rules on it.
+        views = {field: _FieldView(columns[field], field in self.numeric_fields) for field in self.fields}
+        size = len(columns[self.fields[0]]) if self.fields else 0
+        codes = np.zeros(size, dtype=np.int8)
+        with np.errstate(invalid="ignore"):
+            for code in range(len(self.rules), 0, -1):
+                rule = self.rules[code - 1]
+                codes[~_passes(rule, views[rule.field])] = code
+        return codes
+
+    def columns_from_records(self, records):
+        # One C-level transpose when every record has every field, else record.get per field
+        if len(self.fields) > 1 and records:
+            try:
+                rows = map(itemgetter(*self.fields), records)
+                return dict(zip(self.fields, map(list, zip(*rows))))
+            except KeyError:
+                pass
+        return {field: [record.get(field) for record in records] for field in self.fields}
+
+    def validate(self, records):
+        # (records passing every rule, Counter of error messages in first-seen record order)
+        codes = self.first_failures(self.columns_from_records(records))
+        errors = Counter()
+        failing = np.flatnonzero(codes)
+        for i, code in zip(failing.tolist(), codes[failing].tolist()):
+            rule = self.rules[code - 1]
+            errors[rule.message.format(value=records[i].get(rule.field))] += 1
+        if not errors:
+            return list(records), errors
+        return [records[i] for i in np.flatnonzero(codes == 0).tolist()], errors
+
+    def first_failure(self, record):
+        # Message of the first rule a single record fails, or None
+        codes = self.first_failures({field: [record.get(field)] for field in self.fields})
+        if codes[0]:
+            rule = self.rules[codes[0] - 1]
+            return rule.message.format(value=record.get(rule.field))
+        return None
+
+class _FieldView:
+    # Lazily converted representations of one column
+    def __init__(self, values, numeric=False):
+        self.values = values
+        self.numeric = numeric
+        self._null = None
+        self._floats = None
+        self._ints = None
+
+    def null(self):
+        if self._null is None:
+            values = self.values
+            if isinstance(values, list) and self.numeric:
+                # None converts to NaN, so only NaN rows need an identity check
+                candidates = np.flatnonzero(np.isnan(self.floats())).tolist()
+                self._null = np.zeros(len(values), dtype=bool)
+                self._null[candidates] = [values[i] is None for i in candidates]
+            elif isinstance(values, list):
+                self._null = np.array([value is None for value in values], dtype=bool)
+            else:
+                self._null = pd.isna(np.asarray(values))
+        return self._null
+
+    def _filled(self, fill):
+        # Values with nulls replaced by fill, so NumPy can convert the rest in one call
+        if not self.null().any():
+            return self.values
+        return [fill if value is None else value for value in self.values]
+
+    def floats(self):
+        # float(value) per row, NaN where that fails
+        if self._floats is None:
+            try:
+                self._floats = np.array(self.values, dtype=float)  # None becomes NaN
+            except (TypeError, ValueError):
+                self._floats = np.array([_parse(float, value) for value in self.values], dtype=float)
+        return self._floats
+
+    def ints(self):
+        # (int(value) succeeded, value as float) per row
+        if self._ints is None:
+            try:
+                numbers = np.array(self._filled(0), dtype=np.int64).astype(float)  # same parsing as int()
+                ok = ~self.null()
+                numbers[~ok] = np.nan
+                self._ints = ok, numbers
+            except (TypeError, ValueError, OverflowError):
+                parsed = [_parse(int, value) for value in self.values]
+                ok = np.array([value == value for value in parsed], dtype=bool)
+                self._ints = ok, np.array(parsed, dtype=float)
+        return self._ints
+
+def _parse(cast, value):
+    try:
+        return cast(value)
+    except (TypeError, ValueError, OverflowError):
+        return float("nan")
+
+def _passes(rule, view):
+    if rule.kind == "not-null":
+        return ~view.null()
+    if rule.kind == "int-parseable":
+        return view.ints()[0]
+    if rule.kind == "positive":
+        if rule.cast is int:
+            ok, numbers = view.ints()
+            return ok & (numbers > 0)
+        return view.floats() > 0
+    numbers = view.floats()  # range
+    passes = ~np.isnan(numbers)
+    if rule.low is not None:
+        passes &= numbers >= rule.low
+    if rule.high is not None:
+        passes &= numbers <= rule.high
+    return passes
+
+# === Rule sets ===
+
+BREADCRUMB_RULES = RuleSet([
+    Rule("EVENT_NO_TRIP", "not-null", "Null trip_id"),
+    Rule("OPD_DATE", "not-null", "Missing OPD_DATE"),
+    Rule("ACT_TIME", "not-null", "Missing ACT_TIME"),
+    Rule("GPS_LATITUDE", "range", "Latitude {value} out of range", low=45.0, high=46.0),
+    Rule("GPS_LONGITUDE", "range", "Longitude {value} out of range", low=-124.0, high=-121.0),
+    Rule("GPS_HDOP", "range", "HDOP {value} too high", high=5.0),
+])
+
+# The project2/project3 subscriber scripts run the same per-record checks 1-6, but
+# report a null latitude, longitude or HDOP as "... is None" rather than as out of range
+LEGACY_BREADCRUMB_RULES = RuleSet([
+    # 1. Non-null trip_id
+    Rule("EVENT_NO_TRIP", "not-null", "Null trip_id"),
+    # 2 and 3. Valid tstamp (OPD_DATE and ACT_TIME not null)
+    Rule("OPD_DATE", "not-null", "Missing OPD_DATE"),
+    Rule("ACT_TIME", "not-null", "Missing ACT_TIME"),
+    # 4. Latitude must be non-null and in bounds
+    Rule("GPS_LATITUDE", "not-null", "Latitude is None"),
+    Rule("GPS_LATITUDE", "range", "Latitude {value} out of range", low=45.0, high=46.0),
+    # 5. Longitude must be non-null and in bounds
+    Rule("GPS_LONGITUDE", "not-null", "Longitude is None"),
+    Rule("GPS_LONGITUDE", "range", "Longitude {value} out of range", low=-124.0, high=-121.0),
+    # 6. HDOP must be present, <= 5.0
+    Rule("GPS_HDOP", "not-null", "HDOP is None"),
+    Rule("GPS_HDOP", "range", "HDOP {value} too high", high=5.0),
+])
+
+STOP_EVENT_RULES = RuleSet([
+    Rule("vehicle_number", "not-null", "vehicle_number is None"),
+    Rule("vehicle_number", "positive", "vehicle_number {value} not positive", cast=int),
+    Rule("route_number", "not-null", "route_number is None"),
+    Rule("route_number", "positive", "route_number {value} not positive", cast=int),
+    Rule("stop_time", "not-null", "stop_time is None"),
+    Rule("stop_time", "int-parseable", "stop_time {value} not an integer"),
+    Rule("x_coordinate", "not-null", "x_coordinate is None"),
+    Rule("x_coordinate", "positive", "x_coordinate {value} not positive"),
+    Rule("y_coordinate", "not-null", "y_coordinate is None"),
+    Rule("y_coordinate", "positive", "y_coordinate {value} not positive"),
+    Rule("pdx_trip", "not-null", "pdx_trip is None"),
+    Rule("service_date", "not-null", "service_date is None"),
+])
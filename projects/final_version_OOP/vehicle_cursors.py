@@ -0,0 +1,71 @@
+# Per-vehicle high-water marks so already-seen breadcrumbs skip dedup entirely
+
+import os
+import json
+import datetime
+
+class VehicleCursors:
+    def __init__(self, path):
+        # Marks are (OPD_DATE ordinal, EVENT_NO_TRIP, ACT_TIME) tuples keyed by vehicle ID
+        self.path = path
+        self.marks = {}
+        self._date_keys = {}
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.marks = {vid: tuple(mark) for vid, mark in json.load(f).items()}
+            except (OSError, ValueError):
+                self.marks = {}  # a corrupt cursor file only costs one full dedup pass
+
+    def _date_key(self, opd_date):
+        # OPD_DATE looks like "08DEC2022:00:00:00"; parse each distinct string once
+        key = self._date_keys.get(opd_date)
+        if key is None:
+            try:
+                key = datetime.datetime.strptime(opd_date[:9], "%d%b%Y").toordinal()
+            except (TypeError, ValueError):
+                key = -1
+            self._date_keys[opd_date] = key
+        return key
+
+    def position(self, record):
+        # Ordering key of a record, or None if it cannot be ordered
+        trip = record.get("EVENT_NO_TRIP")
+        act_time = record.get("ACT_TIME")
+        date_key = self._date_key(record.get("OPD_DATE"))
+        if trip is None or act_time is None or date_key < 0:
+            return None
+        return (date_key, trip, act_time)
+
+    def filter_new(self, vid, records):
+        # Drop records below the vehicle's mark without serializing or hashing them.
+        # Records at the mark (the boundary window) and unorderable records are kept
+        # for full dedup. The mark advances to the highest position returned.
+        mark = self.marks.get(vid)
+        high = mark
+        kept = []
+        for record in records:
+            pos = self.position(record)
+            try:
+                if pos is not None and mark is not None and pos < mark:
+                    continue
+                if pos is not None and (high is None or pos > high):
+                    high = pos
+            except TypeError:
+                pass  # field types changed under us; let dedup decide
+            kept.append(record)
+        if high != mark:
+            self.marks[vid] = high
+            self._dirty = True
+        return kept
+
+    def save(self):
+        # Persist marks; call only after the records they cover are written
+        if not self._dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.marks, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
@@ -0,0 +1,185 @@
+# Schema-driven binary wire encoding for breadcrumb and StopEvent records
+
+import struct
+import datetime
+
+# Header: magic, schema id, schema version, record count
+MAGIC = b"TMW"
+HEADER = struct.Struct(">3sBBI")
+
+# Field kinds and their fixed-width struct codes
+KIND_CODES = {
+    "int": "q",       # 64-bit signed integer
+    "float": "d",     # 64-bit float
+    "opd_date": "I",  # "08DEC2022:00:00:00" stored as a date ordinal
+    "iso_date": "I",  # "2023-01-10" stored as a date ordinal
+    "text8": "8s",    # short text, NUL padded
+}
+
+class WireSchema:
+    def __init__(self, schema_id, name, version, fields, as_text, null_value):
+        # fields: [(field name, kind)]. as_text: records carry every value as a
+        # string (StopEvent HTML) rather than JSON-typed values (breadcrumbs).
+        # null_value: the record value encoded through the null bitmap.
+        self.schema_id = schema_id
+        self.name = name
+        self.version = version
+        self.fields = fields
+        self.names = [name for name, _ in fields]
+        self.kinds = [kind for _, kind in fields]
+        self.as_text = as_text
+        self.null_value = null_value
+        self.record = struct.Struct("<I" + "".join(KIND_CODES[kind] for kind in self.kinds))
+        self._field_set = set(self.names)
+
+    def attributes(self):
+        # Pub/Sub message attributes identifying the encoding
+        return {"schema": self.name, "schema_version": str(self.version)}
+
+BREADCRUMB_WIRE_SCHEMA = WireSchema(1, "breadcrumb", 1, [
+    ("EVENT_NO_TRIP", "int"),
+    ("EVENT_NO_STOP", "int"),
+    ("OPD_DATE", "opd_date"),
+    ("VEHICLE_ID", "int"),
+    ("METERS", "int"),
+    ("ACT_TIME", "int"),
+    ("GPS_LONGITUDE", "float"),
+    ("GPS_LATITUDE", "float"),
+    ("GPS_SATELLITES", "float"),
+    ("GPS_HDOP", "float"),
+], as_text=False, null_value=None)
+
+STOP_EVENT_WIRE_SCHEMA = WireSchema(2, "stop_event", 1, [
+    ("vehicle_number", "int"), ("leave_time", "int"), ("train", "int"),
+    ("route_number", "int"), ("direction", "int"), ("service_key", "text8"),
+    ("trip_number", "int"), ("stop_time", "int"), ("arrive_time", "int"),
+    ("dwell", "int"), ("location_id", "int"), ("door", "int"), ("lift", "int"),
+    ("ons", "int"), ("offs", "int"), ("estimated_load", "int"),
+    ("maximum_speed", "int"), ("train_mileage", "float"),
+    ("pattern_distance", "float"), ("location_distance", "float"),
+    ("x_coordinate", "float"), ("y_coordinate", "float"),
+    ("data_source", "int"), ("schedule_status", "int"),
+    ("pdx_trip", "int"), ("service_date", "iso_date"),
+], as_text=True, null_value="")
+
+SCHEMAS = {schema.schema_id: schema for schema in (BREADCRUMB_WIRE_SCHEMA, STOP_EVENT_WIRE_SCHEMA)}
+
+_opd_cache = {}
+_ordinal_cache = {}
+
+def _encode_value(kind, value, as_text):
+    # Fixed-width value for a field; raises ValueError when the value would not
+    # decode back to exactly the same record value
+    if kind == "int":
+        if as_text:
+            number = int(value)
+            if str(number) != value:
+                raise ValueError(value)
+            return number
+        if type(value) is not int:
+            raise ValueError(value)
+        return value
+    if kind == "float":
+        if as_text:
+            number = float(value)
+            if repr(number) != value:
+                raise ValueError(value)
+            return number
+        if type(value) is not float:
+            raise ValueError(value)
+        return value
+    if kind == "opd_date":
+        ordinal = _opd_cache.get(value)
+        if ordinal is None:
+            ordinal = datetime.datetime.strptime(value, "%d%b%Y:%H:%M:%S").toordinal()
+            if _decode_date(kind, ordinal) != value:
+                raise ValueError(value)
+            _opd_cache[value] = ordinal
+        return ordinal
+    if kind == "iso_date":
+        ordinal = datetime.date.fromisoformat(value).toordinal()
+        if _decode_date(kind, ordinal) != value:
+            raise ValueError(value)
+        return ordinal
+    if kind == "text8":
+        data = value.encode("utf-8")
+        if len(data) > 8 or b"\0" in data or "\x1f" in value:
+            raise ValueError(value)
+        return data
+    raise ValueError(kind)
+
+def _decode_date(kind, ordinal):
+    key = (kind, ordinal)
+    text = _ordinal_cache.get(key)
+    if text is None:
+        day = datetime.date.fromordinal(ordinal)
+        if kind == "opd_date":
+            text = day.strftime("%d%b%Y").upper() + ":00:00:00"
+        else:
+            text = day.isoformat()
+        _ordinal_cache[key] = text
+    return text
+
+def encode_batch(schema, records):
+    # Binary message for records, or None if any record does not fit the schema
+    # exactly (the caller then falls back to JSON)
+    out = [HEADER.pack(MAGIC, schema.schema_id, schema.version, len(records))]
+    pack = schema.record.pack
+    for record in records:
+        if len(record) != len(schema.names) or not schema._field_set.issuperset(record):
+            return None
+        nulls = 0
+        values = []
+        try:
+            for i, (name, kind) in enumerate(schema.fields):
+                value = record[name]
+                if value is None if schema.null_value is None else value == schema.null_value:
+                    nulls |= 1 << i
+                    values.append(b"" if kind == "text8" else 0)
+                else:
+                    values.append(_encode_value(kind, value, schema.as_text))
+            out.append(pack(nulls, *values))
+        except (TypeError, ValueError, OverflowError, struct.error):
+            return None
+    return b"".join(out)
+
+def is_binary(data):
+    return data[:3] == MAGIC
+
+def decode_batch(data):
+    # Records carried by a binary message
+    _, schema_id, version, count = HEADER.unpack_from(data)
+    schema = SCHEMAS.get(schema_id)
+    if schema is None or version != schema.version:
+        raise ValueError(f"Unknown wire schema {schema_id} version {version}")
+    body = memoryview(data)[HEADER.size:]
+    if len(body) != count * schema.record.size:
+        raise ValueError(f"Wire message size does not match {count} {schema.name} records")
+
+    names = schema.names
+    # Only fields that need converting back are touched per record
+    converters = []
+    for i, kind in enumerate(schema.kinds):
+        if kind in ("opd_date", "iso_date"):
+            converters.append((i, lambda v, kind=kind: _decode_date(kind, v)))
+        elif kind == "text8":
+            converters.append((i, lambda v: v.rstrip(b"\0").decode("utf-8")))
+    # Text records turn all numbers back into strings with one %-format and split
+    text_format = "\x1f".join("%r" if kind == "float" else "%d" if kind == "int" else "%s"
+                               for kind in schema.kinds) if schema.as_text else None
+    null_value = schema.null_value
+
+    records = []
+    for row in schema.record.iter_unpack(body):
+        nulls = row[0]
+        values = list(row[1:])
+        for i, convert in converters:
+            values[i] = convert(values[i])
+        if text_format:
+            values = (text_format % tuple(values)).split("\x1f")
+        if nulls:
+            for i in range(len(names)):
+                if nulls >> i & 1:
+                    values[i] = null_value
+        records.append(dict(zip(names, values)))
+    return records
@@ -1,36 +1,35 @@
 import os
 import json
-import urllib.request
 import datetime
 import time
-from concurrent import futures
 from google.cloud import pubsub_v1
+# Shared helpers from projects/final_version_OOP, which must be on PYTHONPATH
+from segment_archive import append_segment, migrate_legacy_file
+from busdata_client import get_shared_client
+from pipeline_log import get_log_sink
+from publish_limiter import InFlightLimiter
 
 PROJECT_ID = "dataengineering-456318"
 TOPIC_ID = "trimet-breadcrumbs"
 CREDENTIAL_PATH = "/home/xiangqz/pubsub-key.json"
 VEHICLE_FILE = "vehicle_ids.txt"
 DAILY_FILE = f"breadcrumbs_{datetime.datetime.now().strftime('%Y%m%d')}.json"
-ALL_FILE = "bcsample.json"
+ALL_FILE = "bcsample.json"  # legacy whole-file archive, migrated into ARCHIVE_DIR once
+ARCHIVE_DIR = "bcsample"
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIAL_PATH
 publisher = pubsub_v1.PublisherClient()
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+http_client = get_shared_client()  # keep-alive connections reused across vehicles
 
 def log(msg, scope = "main"):
-    ts = datetime.datetime.now().strftime("[%m-%d-%Y--%H:%M:%S.%f]")[:-3]
-    full_msg = f"{ts} {msg}"
-    print(full_msg)
-
+    # Timestamped now; printed and written in batches by the shared background log sink
     if scope == "gather":
-        with open("data_gather.log", "a") as f:
-            f.write(full_msg + "\n")
+        get_log_sink().log("data_gather.log", msg)
     elif scope == "publish":
-        with open("data_pub.log", "a") as f:
-            f.write(full_msg + "\n")
+        get_log_sink().log("data_pub.log", msg)
     else:
-        with open("pipeline.log", "a") as f:
-            f.write(full_msg + "\n")
+        get_log_sink().log("pipeline.log", msg)
 
 def gather_data():
     log("Gathering from PSU API...")
@@ -55,15 +54,17 @@ def gather_data():
     for vid in vehicle_ids:
         url = f"https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id={vid}"
         try:
-            with urllib.request.urlopen(url) as response:
-                if response.status == 200:
-                    records = json.loads(response.read())
-                    for record in records:
-                        record_str = json.dumps(record, sort_keys=True)
-                        if record_str not in record_set:
-                            today_data.append(record)
-                            new_data.append(record)
-                            record_set.add(record_str)
+            status, body = http_client.get(url)
+            if status == 200:
+                records = json.loads(body)
+                for record in records:
+                    record_str = json.dumps(record, sort_keys=True)
+                    if record_str not in record_set:
+                        today_data.append(record)
+                        new_data.append(record)
+                        record_set.add(record_str)
+            else:
+                log(f"Fetch error for vehicle {vid}: HTTP {status}")
         except Exception as e:
             log(f"Fetch error for vehicle {vid}: {e}")
 
@@ -76,42 +77,41 @@ def gather_data():
                  #json.dump(today_data, f, indent=2)
         log(f"Updated daily file: {DAILY_FILE} with {len(new_data)} new records")
 
-        # Append to cumulative file
-        if os.path.exists(ALL_FILE):
-            with open(ALL_FILE, "r") as f:
-                all_data = json.load(f)
-        else:
-            all_data = []
-
-        all_data.extend(new_data)
-
-        with open(ALL_FILE, "w") as f:
-            json.dump(all_data, f, indent=2)
+        # Append to cumulative archive as a new segment (only the new records are written)
+        migrate_legacy_file(ARCHIVE_DIR, ALL_FILE)
+        total = append_segment(ARCHIVE_DIR, new_data)
 
-        log(f"Appended to {ALL_FILE}. Total records: {len(all_data)}")
+        log(f"Appended to {ARCHIVE_DIR}. Total records: {total}")
 
     else:
         log("No new records fetched today.")
 
     return new_data
 
-def publish_data(records):
+def publish_data(records, max_in_flight=500, max_in_flight_bytes=10000000):
     log("Starting publishing...")
-    futures_list = []
     count = 0
+    # Bounds pending publishes; permits come back from the done-callbacks
+    limiter = InFlightLimiter(max_in_flight, max_in_flight_bytes)
 
-    def future_callback(fut):
+    def future_callback(fut, nbytes):
         try:
             fut.result()
+            limiter.release(nbytes, True)
         except Exception as e:
+            limiter.release(nbytes, False)
             log(f"Publish error: {e}")
 
     for record in records:
         try:
             data = json.dumps(record).encode("utf-8")
-            future = publisher.publish(topic_path, data)
-            future.add_done_callback(future_callback)
-            futures_list.append(future)
+            limiter.acquire(len(data))
+            try:
+                future = publisher.publish(topic_path, data)
+            except Exception:
+                limiter.abandon(len(data))
+                raise
+            future.add_done_callback(lambda fut, nbytes=len(data): future_callback(fut, nbytes))
             count += 1
 
             if count % 50000 == 0:
@@ -120,10 +120,12 @@ def publish_data(records):
         except Exception as e:
             log(f"Unexpected publish error: {e}")
 
-    for fut in futures.as_completed(futures_list):
-        pass
+    limiter.wait_idle()
 
     log(f"Publishing complete. Total published: {count}")
+    stats = limiter.stats()
+    log(f"Publish stats: {stats['acked']} acked, {stats['failed']} failed, "
+        f"{stats['messages_per_sec']:.0f} msg/s, peak in flight {stats['peak_in_flight']}")
 
 def main():
     start = time.time()
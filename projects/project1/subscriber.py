@@ -5,6 +5,8 @@ import threading
 import datetime
 from concurrent.futures import TimeoutError
 from google.cloud import pubsub_v1
+# Shared helpers from projects/final_version_OOP, which must be on PYTHONPATH
+from pipeline_log import get_log_sink
 
 # === CONFIGURATION ===
 PROJECT_ID = "dataengineering-456318"
@@ -25,11 +27,8 @@ streaming_pull_future = None
 
 # === LOGGING ===
 def log(msg):
-    ts = datetime.datetime.now().strftime("[%m-%d-%Y--%H:%M:%S.%f]")[:-3]
-    full_msg = f"{ts} {msg}"
-    print(full_msg)
-    with open("subscriber.log", "a") as f:
-        f.write(full_msg + "\n")
+    # Timestamped now; printed and written in batches by the shared background log sink
+    get_log_sink().log("subscriber.log", msg)
 
 
 # === CALLBACK ===
@@ -1,10 +1,12 @@
 import os
 import json
-import urllib.request
 import datetime
 import time
-from concurrent.futures import wait, FIRST_COMPLETED, as_completed
 from google.cloud import pubsub_v1
+# Shared helpers from projects/final_version_OOP, which must be on PYTHONPATH
+from busdata_client import get_shared_client
+from pipeline_log import get_log_sink
+from publish_limiter import InFlightLimiter
 
 # === CONFIGURATION ===
 PROJECT_ID = "dataengineering-456318"
@@ -16,22 +18,23 @@ DAILY_FILE = f"breadcrumbs_{datetime.datetime.now().strftime('%Y%m%d')}.json"
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIAL_PATH
 publisher = pubsub_v1.PublisherClient()
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+http_client = get_shared_client()  # keep-alive connections reused across vehicles
 
 def log(msg, scope="main"):
-    ts = datetime.datetime.now().strftime("[%m-%d-%Y--%H:%M:%S.%f]")[:-3]
-    full_msg = f"{ts} {msg}"
-    print(full_msg)
+    # Timestamped now; printed and written in batches by the shared background log sink
     log_file = {
         "gather": "data_gather.log",
         "publish": "data_pub.log"
     }.get(scope, "pipeline.log")
-    with open(log_file, "a") as f:
-        f.write(full_msg + "\n")
+    get_log_sink().log(log_file, msg)
 
-def future_callback(fut, idx):
+def future_callback(fut, idx, nbytes, limiter):
+    # Runs on the publisher's thread; hands the permit back to the limiter
     try:
         fut.result()
+        limiter.release(nbytes, True)
     except Exception as e:
+        limiter.release(nbytes, False)
         log(f"[ERROR] Record {idx} failed to publish: {e}", "publish")
 
 def gather_data():
@@ -59,14 +62,16 @@ def gather_data():
     for vid in vehicle_ids:
         url = f"https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id={vid}"
         try:
-            with urllib.request.urlopen(url) as response:
-                if response.status == 200:
-                    records = json.loads(response.read())
-                    for record in records:
-                        record_str = json.dumps(record, sort_keys=True)
-                        if record_str not in existing_records:
-                            new_records.append(record)
-                            existing_records.add(record_str)
+            status, body = http_client.get(url)
+            if status == 200:
+                records = json.loads(body)
+                for record in records:
+                    record_str = json.dumps(record, sort_keys=True)
+                    if record_str not in existing_records:
+                        new_records.append(record)
+                        existing_records.add(record_str)
+            else:
+                log(f"Fetch error for vehicle {vid}: HTTP {status}", "gather")
         except Exception as e:
             log(f"Fetch error for vehicle {vid}: {e}", "gather")
 
@@ -81,35 +86,37 @@ def gather_data():
 
     return new_records
 
-def publish_data(records, max_in_flight=500):
+def publish_data(records, max_in_flight=500, max_in_flight_bytes=10000000):
     log("Starting publishing...", "publish")
     published = 0
     skipped = 0
-    futures = []
+    # Bounds pending publishes; permits come back from the done-callbacks
+    limiter = InFlightLimiter(max_in_flight, max_in_flight_bytes)
 
     for i, record in enumerate(records, start=1):
         try:
             message = json.dumps(record).encode("utf-8")
-            future = publisher.publish(topic_path, message)
-            future.add_done_callback(lambda fut, idx=i: future_callback(fut, idx))
-            futures.append(future)
+            limiter.acquire(len(message))
+            try:
+                future = publisher.publish(topic_path, message)
+            except Exception:
+                limiter.abandon(len(message))
+                raise
+            future.add_done_callback(lambda fut, idx=i, nbytes=len(message): future_callback(fut, idx, nbytes, limiter))
             published += 1
             if published % 50000 == 0:
                 log(f"{published} records queued...", "publish")
-            # Throttle: only allow max_in_flight pending publihes
-            if len(futures) >= max_in_flight:
-                done, not_done = wait(futures, return_when=FIRST_COMPLETED)
-                # remove completed
-                futures = list(not_done)
         except Exception as e:
             skipped += 1
             log(f"[ERROR] Record {i} failed to publish: {e}", "publish")
 
-    log(f"Waiting for {len(futures)} publishes to complete...", "publish")
-    for fut in as_completed(futures):
-        pass
+    log(f"Waiting for {limiter.in_flight} publishes to complete...", "publish")
+    limiter.wait_idle()
 
     log(f"[DONE] Published: {published}, Skipped: {skipped}", "publish")
+    stats = limiter.stats()
+    log(f"Publish stats: {stats['acked']} acked, {stats['failed']} failed, "
+        f"{stats['messages_per_sec']:.0f} msg/s, peak in flight {stats['peak_in_flight']}", "publish")
 
 def main():
     start = time.time()
@@ -1,11 +1,13 @@
 import os
 import json
-import urllib.request
 import datetime
 import time
-from concurrent.futures import as_completed, wait, FIRST_COMPLETED
 from google.cloud import pubsub_v1
 from bs4 import BeautifulSoup  # <-- HTML parser
+# Shared helpers from projects/final_version_OOP, which must be on PYTHONPATH
+from busdata_client import get_shared_client
+from pipeline_log import get_log_sink
+from publish_limiter import InFlightLimiter
 
 # === CONFIGURATION ===
 PROJECT_ID = "dataengineering-456318"
@@ -17,17 +19,15 @@ DAILY_FILE = f"stop_events_{datetime.datetime.now().strftime('%Y%m%d')}.json"
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIAL_PATH
 publisher = pubsub_v1.PublisherClient()
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+http_client = get_shared_client()  # keep-alive connections reused across vehicles
 
 def log(msg, scope="main"):
-    ts = datetime.datetime.now().strftime("[%m-%d-%Y--%H:%M:%S.%f]")[:-3]
-    full_msg = f"{ts} {msg}"
-    print(full_msg)
+    # Timestamped now; printed and written in batches by the shared background log sink
     log_file = {
         "gather": "stop_gather.log",
         "publish": "stop_pub.log"
     }.get(scope, "stop_pipeline.log")
-    with open(log_file, "a") as f:
-        f.write(full_msg + "\n")
+    get_log_sink().log(log_file, msg)
 
 def parse_stop_events_html(html_text):
     soup = BeautifulSoup(html_text, "html.parser")
@@ -87,22 +87,23 @@ def gather_data():
     for vid in vehicle_ids:
         url = f"https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num={vid}"
         try:
-            with urllib.request.urlopen(url) as response:
-                raw = response.read().decode("utf-8")
-                if not raw.strip():
-                    log(f"No data returned for vehicle {vid}. Skipping.", "gather")
-                    continue
+            status, body = http_client.get(url)
+            if status != 200:
+                log(f"Fetch error for vehicle {vid}: HTTP {status}", "gather")
+                continue
+            raw = body.decode("utf-8")
+            if not raw.strip():
+                log(f"No data returned for vehicle {vid}. Skipping.", "gather")
+                continue
 
-                records = parse_stop_events_html(raw)
-                #log(f"Vehicle {vid}: Parsed {len(records)} records", "gather")
+            records = parse_stop_events_html(raw)
+            #log(f"Vehicle {vid}: Parsed {len(records)} records", "gather")
 
-                for record in records:
-                    record_str = json.dumps(record, sort_keys=True)
-                    if record_str not in existing_records:
-                        new_records.append(record)
-                        existing_records.add(record_str)
-        except urllib.error.HTTPError as e:
-            log(f"Fetch error for vehicle {vid}: {e}", "gather")
+            for record in records:
+                record_str = json.dumps(record, sort_keys=True)
+                if record_str not in existing_records:
+                    new_records.append(record)
+                    existing_records.add(record_str)
         except Exception as e:
             log(f"Unexpected error for vehicle {vid}: {e}", "gather")
 
@@ -117,40 +118,45 @@ def gather_data():
 
     return new_records
 
-def publish_data(records, max_in_flight = 500):
+def publish_data(records, max_in_flight = 500, max_in_flight_bytes = 10000000):
     log("Starting publishing of StopEvent data...", "publish")
     published = 0
-    skipped_counter = {"count": 0}
-    futures = []
+    skipped = 0
+    # Bounds pending publishes; permits come back from the done-callbacks,
+    # which also count failed publishes thread-safely
+    limiter = InFlightLimiter(max_in_flight, max_in_flight_bytes)
 
-    def future_callback(fut):
+    def future_callback(fut, nbytes):
         try:
             fut.result()
+            limiter.release(nbytes, True)
         except Exception:
-            skipped_counter["count"] += 1
+            limiter.release(nbytes, False)
 
     for i, record in enumerate(records, start=1):
         try:
             message = json.dumps(record).encode("utf-8")
-            future = publisher.publish(topic_path, message)
-            future.add_done_callback(future_callback)
-            futures.append(future)
+            limiter.acquire(len(message))
+            try:
+                future = publisher.publish(topic_path, message)
+            except Exception:
+                limiter.abandon(len(message))
+                raise
+            future.add_done_callback(lambda fut, nbytes=len(message): future_callback(fut, nbytes))
             published += 1
             if published % 50000 == 0:
                 log(f"{published} records queued...", "publish")
-            # Throttle after max_in_flight outstanding
-            if len(futures) >= max_in_flight:
-                done, not_done = wait(futures, return_when = FIRST_COMPLETED)
-                futures = list(not_done)
         except Exception as e:
-            skipped_counter["count"] += 1
+            skipped += 1
             log(f"[ERROR] Record {i} failed to publish: {e}", "publish")
 
-    log(f"Waiting for {len(futures)} publishes to complete...", "publish")
-    for fut in as_completed(futures):
-        pass
+    log(f"Waiting for {limiter.in_flight} publishes to complete...", "publish")
+    limiter.wait_idle()
 
-    log(f"[DONE] Published: {published}, Skipped: {skipped_counter['count']}", "publish")
+    log(f"[DONE] Published: {published}, Skipped: {skipped + limiter.failed}", "publish")
+    stats = limiter.stats()
+    log(f"Publish stats: {stats['acked']} acked, {stats['failed']} failed, "
+        f"{stats['messages_per_sec']:.0f} msg/s, peak in flight {stats['peak_in_flight']}", "publish")
 
 def main():
     start = time.time()
@@ -10,6 +10,8 @@ from datetime import datetime, timedelta
 from google.cloud import pubsub_v1
 from psycopg2.extras import execute_batch
 from collections import defaultdict
+# Shared helpers from projects/final_version_OOP, which must be on PYTHONPATH
+from validation_rules import LEGACY_BREADCRUMB_RULES
 
 # === CONFIGURATION ===
 PROJECT_ID = "dataengineering-456318"
@@ -45,45 +47,13 @@ ctx = CollectorContext()
 error_counters = defaultdict(int)
 error_first_message = {}
 
-# 1. Non-null trip_id
-def assert_trip_id(record):
-    assert record.get("EVENT_NO_TRIP") is not None, "Null trip_id"
-
-# 2 and 3. Valid tstamp (OPD_DATE and ACT_TIME not null, and can be combined into a timestamp)
-def assert_tstamp(record):
-    assert record.get("OPD_DATE") is not None, "Missing OPD_DATE"
-    assert record.get("ACT_TIME") is not None, "Missing ACT_TIME"
-
-# 4. Latitude must be non-null and in bounds
-def assert_latitude(record):
-    lat = record.get("GPS_LATITUDE")
-    assert lat is not None, "Latitude is None"
-    assert 45.0 <= lat <= 46.0, f"Latitude {lat} out of range"
-
-# 5. Longitude must be non-null and in bounds
-def assert_longitude(record):
-    lon = record.get("GPS_LONGITUDE")
-    assert lon is not None, "Longitude is None"
-    assert -124.0 <= lon <= -121.0, f"Longitude {lon} out of range"
-
-# 6. HDOP must be present, ≤ 5.0
-def assert_hdop(record):
-    hdop = record.get("GPS_HDOP")
-    assert hdop is not None, "HDOP is None"
-    assert hdop <= 5.0, f"HDOP {hdop} too high"
+# Per-record checks 1-6 run for a whole batch as columnar masks (LEGACY_BREADCRUMB_RULES
+# in validation_rules); a record is reported under its first failing rule
 
 # 7. Trip must have at least two readings
 def assert_trip_length(trip_records):
     assert len(trip_records) >= 2, "Trip has less than 2 readings"
 
-assertion_funcs = [
-    assert_trip_id,
-    assert_tstamp,
-    assert_latitude,
-    assert_longitude,
-    assert_hdop
-]
-
 # Pub/Sub callback
 def callback(message):
     try:
@@ -119,26 +89,18 @@ def validate_and_transform():
     discarded = 0
     trip_dict = {}
 
-    # --- Per-record validation ---
-    for record in ctx.collected_messages:
-        valid = True
-        for func in assertion_funcs:
-            try:
-                func(record)
-            except AssertionError as e:
-                err_type = str(e)
-                error_counters[err_type] += 1
-                if err_type not in error_first_message:
-                    error_first_message[err_type] = f"Validation error: {err_type}"
-                valid = False
-                break
-        if valid:
-            tid = record.get("EVENT_NO_TRIP")
-            if tid not in trip_dict:
-                trip_dict[tid] = []
-            trip_dict[tid].append(record)
-        else:
-            discarded += 1
+    # --- Per-record validation (one pass over the whole batch) ---
+    passed, errors = LEGACY_BREADCRUMB_RULES.validate(ctx.collected_messages)
+    for err_type, count in errors.items():
+        error_counters[err_type] += count
+        if err_type not in error_first_message:
+            error_first_message[err_type] = f"Validation error: {err_type}"
+    discarded += len(ctx.collected_messages) - len(passed)
+    for record in passed:
+        tid = record.get("EVENT_NO_TRIP")
+        if tid not in trip_dict:
+            trip_dict[tid] = []
+        trip_dict[tid].append(record)
 
     # --- Inter-record/trip-level validation ---
     for trip_id, records in trip_dict.items():